@@ -0,0 +1,96 @@
+"""
+Copy throughput for a "many small files" tree and a "few large files" tree with different engine settings.
+
+Usage: python benchmarks/bench_copy.py [--small-files 20000] [--large-files 2] [--large-mb 512] [--jobs 8] [--tmp DIR]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers.ignore import IgnoreMatcher
+from main import Helpers, walk
+
+MB = 1024 * 1024
+
+
+def make_small_tree(root, n_files, per_dir=200):
+    for i in range(n_files):
+        d = os.path.join(root, f"dir_{i // per_dir}")
+        if i % per_dir == 0:
+            os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, f"file_{i}.txt"), "wb") as f:
+            f.write(os.urandom(512 + (i * 37) % 8192))
+
+
+def make_large_tree(root, n_files, size_mb):
+    os.makedirs(root, exist_ok=True)
+    block = os.urandom(MB)
+    for i in range(n_files):
+        with open(os.path.join(root, f"image_{i}.bin"), "wb") as f:
+            for _ in range(size_mb):
+                f.write(block)
+
+
+def tree_bytes(root):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+
+
+def run(src, dst, **kwargs):
+    shutil.rmtree(dst, ignore_errors=True)
+    start = time.perf_counter()
+    Helpers().do_deep_copy(walk(src, IgnoreMatcher([])), dst, curr_verbosity=0, use_manifest=False, **kwargs)
+    return time.perf_counter() - start
+
+
+def report(profile, label, src, elapsed):
+    n_files = sum(len(files) for _, _, files in os.walk(src))
+    mb = tree_bytes(src) / MB
+    print(f"{profile:<6} {label:<40} {elapsed:7.2f}s {n_files / elapsed:10.0f} files/s {mb / elapsed:9.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--small-files", type=int, default=20000)
+    parser.add_argument("--large-files", type=int, default=2)
+    parser.add_argument("--large-mb", type=int, default=512)
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--tmp", type=str, help="Where to create the trees. Use a dir on the disk you want to measure.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.tmp) as tmp:
+        small = os.path.join(tmp, "small")
+        large = os.path.join(tmp, "large")
+        dst = os.path.join(tmp, "dst")
+        make_small_tree(small, args.small_files)
+        make_large_tree(large, args.large_files, args.large_mb)
+
+        jobs = args.jobs
+        small_runs = [
+            ("shutil, 1 thread", dict(copy_backend="shutil")),
+            ("auto, 1 thread", dict()),
+            (f"auto, {jobs} threads, batch 1", dict(jobs=jobs, batch_size=1)),
+            (f"auto, {jobs} threads, batch 32", dict(jobs=jobs, batch_size=32)),
+            (f"auto, {jobs} threads, batch 128", dict(jobs=jobs, batch_size=128)),
+        ]
+        large_runs = [
+            ("shutil", dict(copy_backend="shutil")),
+            ("buffer, streamed", dict(copy_backend="buffer", large_file_threshold=1 << 62)),
+            ("copy_file_range, streamed", dict(copy_backend="copy_file_range", large_file_threshold=1 << 62)),
+            (f"buffer, 64MB chunks x {jobs}", dict(copy_backend="buffer", large_file_threshold=64 * MB, chunk_workers=jobs)),
+            (f"copy_file_range, 64MB chunks x {jobs}", dict(copy_backend="copy_file_range", large_file_threshold=64 * MB, chunk_workers=jobs)),
+            ("auto", dict()),
+        ]
+
+        for label, kwargs in small_runs:
+            report("small", label, small, run(small, dst, **kwargs))
+        for label, kwargs in large_runs:
+            report("large", label, large, run(large, dst, **kwargs))
+
+
+if __name__ == "__main__":
+    main()
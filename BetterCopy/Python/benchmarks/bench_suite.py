@@ -0,0 +1,234 @@
+"""
+Walker, matcher and copy engine against a synthetic tree, with results written as JSON so runs can be compared.
+
+Usage: python benchmarks/bench_suite.py [--width 4] [--depth 3] [--files-per-dir 20] [--sizes lognormal]
+                                        [--patterns 200] [--jobs 8] [--repeat 3] [--output results.json]
+                                        [--compare baseline.json] [--threshold 0.1] [--tmp DIR]
+
+Every case runs --repeat times and the median is kept. With --compare, each case is checked against the same case in
+an earlier results file and the script exits with 1 if any got more than --threshold slower, so it can gate a release.
+Runs on different trees (see synthetic.make_tree) are never compared.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import make_tree, SIZE_DISTRIBUTIONS
+from helpers.ignore import IgnoreMatcher, read_ignore_file
+from helpers.stats import Stats
+from main import FileTree, Helpers, walk
+
+
+def median_time(fn, repeat) -> tuple[float, list[float]]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), times
+
+
+def result(name, seconds, times, items, unit, **extra) -> dict:
+    return {
+        "name": name,
+        "seconds": round(seconds, 6),
+        "runs": [round(t, 6) for t in times],
+        "items": items,
+        "unit": unit,
+        "per_s": round(items / max(seconds, 1e-9), 3),
+        **extra,
+    }
+
+
+def bench_walk(src, patterns, repeat) -> list[dict]:
+    matcher = IgnoreMatcher(patterns)
+    # Entries the walker actually looks at, ignored folders are never opened
+    stats = Stats()
+    for _ in walk(src, matcher, stats=stats):
+        pass
+    entries = stats.counters["entries"]
+
+    def run_walk():
+        for _ in walk(src, matcher):
+            pass
+
+    def run_filetree():
+        FileTree(src, 0, [], patterns, matcher=matcher)
+
+    seconds, times = median_time(run_walk, repeat)
+    out = [result("walk", seconds, times, entries, "entries")]
+    seconds, times = median_time(run_filetree, repeat)
+    out.append(result("filetree", seconds, times, entries, "entries"))
+    return out
+
+
+def bench_match(src, patterns, repeat) -> list[dict]:
+    start = time.perf_counter()
+    matcher = IgnoreMatcher(patterns)
+    compile_seconds = time.perf_counter() - start
+
+    paths = []
+    for d, dirs, files in os.walk(src):
+        rel = os.path.relpath(d, src).replace(os.sep, "/")
+        prefix = "" if rel == "." else f"{rel}/"
+        paths.extend((prefix + name, True) for name in dirs)
+        paths.extend((prefix + name, False) for name in files)
+
+    # Goes through FileTree.pattern_matcher so a regression in that wrapper shows up too
+    tree = FileTree(src, 0, [], patterns, scan=False, matcher=matcher)
+
+    def run():
+        for rel_path, is_dir in paths:
+            tree.pattern_matcher(rel_path, is_dir)
+
+    seconds, times = median_time(run, repeat)
+    return [result("match", seconds, times, len(paths), "paths", compile_seconds=round(compile_seconds, 6),
+                   ns_per_path=round(seconds / max(len(paths), 1) * 1e9, 1))]
+
+
+def bench_copy(src, patterns, dst, repeat, jobs) -> list[dict]:
+    matcher = IgnoreMatcher(patterns)
+    cases = [
+        ("copy", dict()),
+        (f"copy_j{jobs}", dict(jobs=jobs)),
+    ]
+
+    out = []
+    for name, kwargs in cases:
+        phases = []
+
+        def run():
+            shutil.rmtree(dst, ignore_errors=True)
+            stats = Stats()
+            Helpers().do_deep_copy(walk(src, matcher, stats=stats), dst, curr_verbosity=0, use_manifest=False, stats=stats, **kwargs)
+            phases.append(stats.to_dict())
+
+        seconds, times = median_time(run, repeat)
+        # Keep the counters and phases of the median run
+        stats = phases[times.index(seconds)] if seconds in times else phases[-1]
+        out.append(result(name, seconds, times, stats["counters"]["files"], "files",
+                          mb_per_s=round(stats["counters"]["bytes"] / (1024 * 1024) / max(seconds, 1e-9), 3),
+                          phases=stats["phases"], counters=stats["counters"]))
+
+    # Second run into the same dst with nothing changed, which is all metadata
+    out.append(incremental_case(src, matcher, dst, repeat))
+    return out
+
+
+def incremental_case(src, matcher, dst, repeat) -> dict:
+    shutil.rmtree(dst, ignore_errors=True)
+    Helpers().do_deep_copy(walk(src, matcher), dst, curr_verbosity=0)
+    stats_runs = []
+
+    def run():
+        stats = Stats()
+        Helpers().do_deep_copy(walk(src, matcher, stats=stats), dst, curr_verbosity=0, incremental=True, stats=stats)
+        stats_runs.append(stats.to_dict())
+
+    seconds, times = median_time(run, repeat)
+    stats = stats_runs[-1]
+    return result("incremental_noop", seconds, times, stats["counters"]["skipped"], "files", phases=stats["phases"],
+                  counters=stats["counters"])
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold) -> list[str]:
+    """
+    Returns a line per case that got more than threshold (0.1 = 10%) slower than in baseline.
+    """
+    if baseline["tree"] != results["tree"]:
+        raise SystemExit("The baseline was run on a different tree, rerun it with the same --width/--depth/... options")
+
+    old = {r["name"]: r for r in baseline["results"]}
+    regressions = []
+    for r in results["results"]:
+        before = old.get(r["name"])
+        if before is None:
+            continue
+        ratio = r["seconds"] / max(before["seconds"], 1e-9)
+        line = f"{r['name']:<18} {before['seconds']:9.4f}s -> {r['seconds']:9.4f}s ({ratio - 1:+.1%})"
+        print(line)
+        if ratio > 1 + threshold:
+            regressions.append(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=4, help="Subfolders per folder")
+    parser.add_argument("--depth", type=int, default=3, help="Levels of subfolders below the root")
+    parser.add_argument("--files-per-dir", type=int, default=20)
+    parser.add_argument("--sizes", type=str, default="lognormal", help=f"File size distribution, one of: {', '.join(SIZE_DISTRIBUTIONS)} (see benchmarks/synthetic.py)")
+    parser.add_argument("--patterns", type=int, default=200, help="Lines in the generated ignore file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-copy", action="store_true", help="Only run the walker and matcher cases")
+    parser.add_argument("--output", type=str, help="Write the results as JSON here")
+    parser.add_argument("--compare", type=str, help="An earlier --output file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.1, help="How much slower a case may get with --compare. The default is: 0.1 (10%%)")
+    parser.add_argument("--tmp", type=str, help="Where to create the trees. Use a dir on the disk you want to measure.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.tmp) as tmp:
+        src = os.path.join(tmp, "src")
+        dst = os.path.join(tmp, "dst")
+        tree = make_tree(src, args.width, args.depth, args.files_per_dir, args.sizes, args.patterns, args.seed)
+        patterns = read_ignore_file(os.path.join(src, ".bcignore"))
+
+        cases = bench_walk(src, patterns, args.repeat) + bench_match(src, patterns, args.repeat)
+        if not args.skip_copy:
+            cases += bench_copy(src, patterns, dst, args.repeat, args.jobs)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": args.repeat,
+            "jobs": args.jobs,
+        },
+        "tree": tree,
+        "results": cases,
+    }
+
+    print(f"tree: {tree['dirs']} folders, {tree['files']} files, {tree['bytes'] / (1024 * 1024):.1f} MB, {tree['patterns']} ignore patterns")
+    for r in cases:
+        print(f"{r['name']:<18} {r['seconds']:9.4f}s {r['per_s']:12.0f} {r['unit']}/s")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} case(s) got more than {args.threshold:.0%} slower:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
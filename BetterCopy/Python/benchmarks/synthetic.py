@@ -0,0 +1,132 @@
+"""
+Synthetic source trees for the benchmarks: a configurable fan-out, depth, number of files per folder, file size
+distribution and number of ignore patterns, all driven by a seed so two runs build the exact same tree.
+"""
+import math
+import os
+import random
+
+KB = 1024
+MB = 1024 * KB
+
+# Name stems the ignore patterns below are written against, so a known share of the tree is left out
+EXTENSIONS = ("txt", "py", "log", "tmp", "json", "bin", "o", "md")
+
+SIZE_DISTRIBUTIONS = ("fixed", "uniform", "lognormal", "mixed")
+
+
+def parse_sizes(spec: str):
+    """
+    Turn a size distribution spec into a function rng -> size in bytes:
+        fixed:4096              every file is 4 KB
+        uniform:0:65536         evenly spread between the two bounds
+        lognormal:8192:1.5      median 8 KB, sigma 1.5, which is roughly what a source tree looks like
+        mixed:0.01:64           like lognormal:4096:1.2, but 1% of files are 64 MB
+    """
+    name, _, rest = spec.partition(":")
+    args = [float(x) for x in rest.split(":")] if rest else []
+
+    if name == "fixed":
+        size = int(args[0]) if args else 4 * KB
+        return lambda rng: size
+    if name == "uniform":
+        lo, hi = (int(args[0]), int(args[1])) if len(args) == 2 else (0, 64 * KB)
+        return lambda rng: rng.randint(lo, hi)
+    if name == "lognormal":
+        median, sigma = (args[0], args[1]) if len(args) == 2 else (8 * KB, 1.5)
+        mu = math.log(median)
+        # Capped so one unlucky draw can't produce a multi-GB file
+        return lambda rng: min(int(rng.lognormvariate(mu, sigma)), 256 * MB)
+    if name == "mixed":
+        share, large_mb = (args[0], args[1]) if len(args) == 2 else (0.01, 64)
+        mu = math.log(4 * KB)
+        return lambda rng: int(large_mb * MB) if rng.random() < share else min(int(rng.lognormvariate(mu, 1.2)), 16 * MB)
+
+    raise ValueError(f"Unknown size distribution {spec!r}, expected one of: {', '.join(SIZE_DISTRIBUTIONS)}")
+
+
+def make_ignore_patterns(n: int, rng: random.Random, head=()) -> list[str]:
+    """
+    n gitignore lines of the kinds real ignore files have (literals, extensions, anchored folders, ** globs,
+    character classes) and a few negations. The lines in head come first, for patterns that should really hit a tree.
+    """
+    patterns = list(head)[:n]
+    for i in range(len(patterns), n):
+        kind = i % 5
+        if kind == 0:
+            patterns.append(f"literal_{i}")
+        elif kind == 1:
+            patterns.append(f"*.ext{i}")
+        elif kind == 2:
+            patterns.append(f"/top_{i}/")
+        elif kind == 3:
+            patterns.append(f"dir_{i}/**/*.tmp{i}")
+        else:
+            patterns.append(f"file_{i}_?.[ch]")
+    # A few negations so the "last match wins" path is exercised too
+    if n:
+        patterns.extend(f"!literal_{rng.randrange(0, n, 5)}" for _ in range(5))
+    return patterns
+
+
+def make_tree(root: str, width=4, depth=3, files_per_dir=20, sizes="lognormal", patterns=0, seed=0) -> dict:
+    """
+    Build a tree under root: every folder holds files_per_dir files and, above depth, width subfolders. One folder
+    in ten is called "build". An ignore file with `patterns` lines is written as root/.bcignore.
+
+    Returns a description of the tree (its parameters plus how many folders, files and bytes it has), which the
+    suite stores with its results so runs on different trees aren't compared by accident.
+    """
+    rng = random.Random(seed)
+    size_of = parse_sizes(sizes)
+    block = rng.randbytes(MB)
+
+    os.makedirs(root, exist_ok=True)
+    # Only these hit the tree (*.log, *.tmp, build/ folders and one top level folder), the rest make the matcher work
+    ignore = make_ignore_patterns(patterns, rng, head=("*.log", "*.tmp", "build/", "/d0_1/"))
+    with open(os.path.join(root, ".bcignore"), "w") as f:
+        f.write("\n".join(ignore) + "\n")
+
+    n_dirs = 0
+    n_files = 0
+    n_bytes = 0
+    stack = [(root, 0, "d0")]
+    while stack:
+        path, level, name = stack.pop()
+        os.makedirs(path, exist_ok=True)
+        n_dirs += 1
+
+        for i in range(files_per_dir):
+            size = size_of(rng)
+            with open(os.path.join(path, f"file_{i}.{EXTENSIONS[i % len(EXTENSIONS)]}"), "wb") as f:
+                # Slices of one random block, so building a big tree isn't bound by os.urandom
+                remaining = size
+                while remaining > 0:
+                    n = min(remaining, len(block))
+                    offset = rng.randrange(len(block) - n + 1)
+                    f.write(block[offset:offset + n])
+                    remaining -= n
+            n_files += 1
+            n_bytes += size
+
+        if level < depth:
+            # Siblings are only created once popped off the stack, so names already taken are tracked here
+            taken = set()
+            for i in range(width):
+                child = "build" if rng.random() < 0.1 else f"{name}_{i}"
+                if child in taken:
+                    child = f"{name}_{i}"
+                taken.add(child)
+                stack.append((os.path.join(path, child), level + 1, child))
+
+    return {
+        "width": width,
+        "depth": depth,
+        "files_per_dir": files_per_dir,
+        "sizes": sizes,
+        "patterns": len(ignore),
+        "seed": seed,
+        "dirs": n_dirs,
+        "files": n_files,
+        "bytes": n_bytes,
+    }
@@ -0,0 +1,215 @@
+import os
+import stat
+import tarfile
+import time
+import zipfile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Longest suffixes first so ".tar.gz" wins over ".gz"
+ARCHIVE_FORMATS = {
+    ".tar.gz": "gz",
+    ".tgz": "gz",
+    ".tar.bz2": "bz2",
+    ".tbz2": "bz2",
+    ".tar.xz": "xz",
+    ".txz": "xz",
+    ".tar.zst": "zst",
+    ".tzst": "zst",
+    ".tar": "tar",
+    ".zip": "zip",
+}
+
+
+def archive_format(path) -> str | None:
+    """
+    Which archive format a dst path asks for, based on its suffix, or None for a plain directory copy.
+    """
+    name = str(path).lower()
+    for suffix, fmt in ARCHIVE_FORMATS.items():
+        if name.endswith(suffix):
+            return fmt
+    return None
+
+
+def missing_module(fmt) -> str | None:
+    """
+    The optional package a format needs that isn't installed, if any.
+    """
+    if fmt == "zst" and zstandard is None:
+        return "zstandard"
+    return None
+
+
+def iter_archive_items(src_dirs, follow_symlinks=False, chunk_size=READ_CHUNK_SIZE):
+    """
+    Turn a walk() stream into what ArchiveWriter.write_items() consumes:
+        ("dir", rel_path, stat)
+        ("symlink", rel_path, stat, target)
+        ("file", rel_path, stat) followed by the file's content as bytes chunks adding up to exactly stat.st_size
+        ("error", rel_path, exception) for a file that couldn't be read
+
+    This is all the reading, so it's meant to run on its own thread (see prefetch() in main.py) while the writer
+    compresses on another.
+    """
+    for d in src_dirs:
+        prefix = f"{d.rel_path}/" if d.rel_path else ""
+        if d.rel_path:
+            yield "dir", d.rel_path, os.stat(d.path)
+
+        for name in d.files:
+            path = os.path.join(d.path, name)
+            rel_path = prefix + name
+
+            if not follow_symlinks and os.path.islink(path):
+                yield "symlink", rel_path, os.lstat(path), os.readlink(path)
+                continue
+
+            try:
+                f = open(path, "rb")
+            except OSError as e:
+                yield "error", rel_path, e
+                continue
+
+            with f:
+                st = os.fstat(f.fileno())
+                yield "file", rel_path, st
+
+                # The header already promised st_size bytes, so a file that shrinks while we read it is padded
+                # and one that grows is cut off
+                remaining = st.st_size
+                while remaining > 0:
+                    chunk = f.read(min(chunk_size, remaining)) or bytes(min(chunk_size, remaining))
+                    remaining -= len(chunk)
+                    yield chunk
+
+
+class ChunkReader:
+    """
+    File-like view over the next `size` bytes of chunks in an item stream, for tarfile.addfile().
+    """
+    def __init__(self, items, size) -> None:
+        self.items = items
+        self.remaining = size
+        self.buf = b""
+
+    def read(self, n=-1) -> bytes:
+        if n < 0:
+            n = self.remaining + len(self.buf)
+
+        parts = [self.buf]
+        have = len(self.buf)
+        while have < n and self.remaining > 0:
+            chunk = next(self.items)
+            self.remaining -= len(chunk)
+            parts.append(chunk)
+            have += len(chunk)
+
+        data = b"".join(parts)
+        self.buf = data[n:]
+        return data[:n]
+
+
+class ArchiveWriter:
+    """
+    Writes an item stream from iter_archive_items() into a tar (optionally gz/bz2/xz/zst compressed) or zip file.
+
+    Everything is written to "<dst>.bctmp" and only renamed to dst once it's complete, so a failed run never leaves
+    a truncated archive that looks finished.
+    """
+    def __init__(self, dst, fmt) -> None:
+        self.dst = str(dst)
+        self.tmp = f"{self.dst}.bctmp"
+        self.fmt = fmt
+        self.raw = None
+        self.zst = None
+        self.tar = None
+        self.zip = None
+        self.files = 0
+        self.bytes = 0
+        self.errors = []
+
+    def __enter__(self) -> "ArchiveWriter":
+        if self.fmt == "zip":
+            self.zip = zipfile.ZipFile(self.tmp, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        elif self.fmt == "zst":
+            if zstandard is None:
+                raise RuntimeError("Writing .tar.zst needs the zstandard package: pip install zstandard")
+            self.raw = open(self.tmp, "wb")
+            self.zst = zstandard.ZstdCompressor().stream_writer(self.raw)
+            self.tar = tarfile.open(fileobj=self.zst, mode="w|", format=tarfile.PAX_FORMAT)
+        else:
+            mode = "w" if self.fmt == "tar" else f"w:{self.fmt}"
+            self.tar = tarfile.open(self.tmp, mode, format=tarfile.PAX_FORMAT)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        for f in (self.zip, self.tar, self.zst, self.raw):
+            if f is not None:
+                f.close()
+
+        if exc_type is None:
+            os.replace(self.tmp, self.dst)
+        elif os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+    def tar_info(self, rel_path, st, type) -> tarfile.TarInfo:
+        info = tarfile.TarInfo(rel_path)
+        info.type = type
+        info.mode = stat.S_IMODE(st.st_mode)
+        info.mtime = st.st_mtime
+        info.uid = st.st_uid
+        info.gid = st.st_gid
+        return info
+
+    def zip_info(self, rel_path, st) -> zipfile.ZipInfo:
+        # Zip can't store dates before 1980
+        date_time = time.localtime(max(st.st_mtime, 315532800))[:6]
+        info = zipfile.ZipInfo(rel_path, date_time)
+        info.external_attr = (st.st_mode & 0xFFFF) << 16
+        info.compress_type = zipfile.ZIP_DEFLATED
+        return info
+
+    def write_items(self, items) -> None:
+        items = iter(items)
+        for item in items:
+            kind, rel_path = item[0], item[1]
+
+            if kind == "dir":
+                if self.tar is not None:
+                    self.tar.addfile(self.tar_info(rel_path, item[2], tarfile.DIRTYPE))
+                else:
+                    info = self.zip_info(rel_path + "/", item[2])
+                    info.external_attr |= 0x10
+                    self.zip.writestr(info, b"")
+            elif kind == "symlink":
+                if self.tar is not None:
+                    info = self.tar_info(rel_path, item[2], tarfile.SYMTYPE)
+                    info.linkname = item[3]
+                    self.tar.addfile(info)
+                else:
+                    # Zip has no real symlinks, store the link target as the content like `zip --symlinks` does
+                    self.zip.writestr(self.zip_info(rel_path, item[2]), item[3])
+                self.files += 1
+            elif kind == "file":
+                st = item[2]
+                if self.tar is not None:
+                    info = self.tar_info(rel_path, st, tarfile.REGTYPE)
+                    info.size = st.st_size
+                    self.tar.addfile(info, ChunkReader(items, st.st_size))
+                else:
+                    with self.zip.open(self.zip_info(rel_path, st), "w", force_zip64=st.st_size >= zipfile.ZIP64_LIMIT) as w:
+                        remaining = st.st_size
+                        while remaining > 0:
+                            chunk = next(items)
+                            remaining -= len(chunk)
+                            w.write(chunk)
+                self.files += 1
+                self.bytes += st.st_size
+            elif kind == "error":
+                self.errors.append((rel_path, item[2]))
@@ -0,0 +1,261 @@
+import errno
+import os
+import shutil
+import threading
+from concurrent.futures import wait
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+# From linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+BUFFER_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024 * 1024
+LARGE_FILE_THRESHOLD = 256 * 1024 * 1024
+
+# errnos that mean "this strategy doesn't work between these two filesystems", as opposed to a real I/O error
+UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EBADF,
+    errno.ETXTBSY,
+}
+
+
+class UnsupportedStrategy(Exception):
+    pass
+
+
+class UnsupportedBackend(OSError):
+    """
+    A forced --copy-backend doesn't work between these two filesystems.
+    """
+
+
+def reflink(src_fd, dst_fd, size):
+    if fcntl is None:
+        raise UnsupportedStrategy("reflink")
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError as e:
+        if e.errno in UNSUPPORTED_ERRNOS:
+            raise UnsupportedStrategy("reflink") from e
+        raise
+
+
+def copy_file_range(src_fd, dst_fd, size):
+    if not hasattr(os, "copy_file_range"):
+        raise UnsupportedStrategy("copy_file_range")
+
+    copied = 0
+    while copied < size:
+        try:
+            n = os.copy_file_range(src_fd, dst_fd, size - copied)
+        except OSError as e:
+            # Only fall back if nothing was written yet, otherwise it's a real failure
+            if copied == 0 and e.errno in UNSUPPORTED_ERRNOS:
+                raise UnsupportedStrategy("copy_file_range") from e
+            raise
+        if n == 0:
+            break
+        copied += n
+
+
+def sendfile(src_fd, dst_fd, size):
+    if not hasattr(os, "sendfile"):
+        raise UnsupportedStrategy("sendfile")
+
+    copied = 0
+    while copied < size:
+        try:
+            n = os.sendfile(dst_fd, src_fd, copied, min(size - copied, 1 << 30))
+        except OSError as e:
+            if copied == 0 and e.errno in UNSUPPORTED_ERRNOS:
+                raise UnsupportedStrategy("sendfile") from e
+            raise
+        if n == 0:
+            break
+        copied += n
+
+
+def buffered(src_fd, dst_fd, size):
+    buf = bytearray(min(BUFFER_SIZE, max(size, 1)))
+    view = memoryview(buf)
+    with open(src_fd, "rb", buffering=0, closefd=False) as f:
+        while n := f.readinto(buf):
+            written = 0
+            while written < n:
+                written += os.write(dst_fd, view[written:n])
+
+
+def copy_file_range_at(src_fd, dst_fd, offset, length):
+    if not hasattr(os, "copy_file_range"):
+        raise UnsupportedStrategy("copy_file_range")
+
+    copied = 0
+    while copied < length:
+        try:
+            n = os.copy_file_range(src_fd, dst_fd, length - copied, offset + copied, offset + copied)
+        except OSError as e:
+            if copied == 0 and e.errno in UNSUPPORTED_ERRNOS:
+                raise UnsupportedStrategy("copy_file_range") from e
+            raise
+        if n == 0:
+            break
+        copied += n
+
+
+def pread_pwrite(src_fd, dst_fd, offset, length):
+    end = offset + length
+    while offset < end:
+        data = os.pread(src_fd, min(BUFFER_SIZE, end - offset), offset)
+        if not data:
+            break
+        view = memoryview(data)
+        while view:
+            n = os.pwrite(dst_fd, view, offset)
+            view = view[n:]
+            offset += n
+
+
+def preallocate(fd, size):
+    # Lets the filesystem lay the file out in one go instead of growing it chunk by chunk
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass
+    os.ftruncate(fd, size)
+
+
+STRATEGIES = {
+    "reflink": reflink,
+    "copy_file_range": copy_file_range,
+    "sendfile": sendfile,
+    "buffer": buffered,
+}
+
+# Strategies that can copy a byte range at an explicit offset, so a large file can be split up
+RANGE_STRATEGIES = {
+    "copy_file_range": copy_file_range_at,
+    "buffer": pread_pwrite,
+}
+
+# "auto" tries these in order, cheapest first
+AUTO_ORDER = ("reflink", "copy_file_range", "sendfile", "buffer")
+
+BACKENDS = ("auto", *STRATEGIES, "shutil")
+
+
+class CopyBackend:
+    """
+    Copies a single file with the best strategy the source and destination filesystems support.
+
+    "auto" tries a FICLONE reflink (instant on CoW filesystems like btrfs/XFS), then os.copy_file_range, then
+    os.sendfile, then a large-buffer read/write loop. When a strategy reports it isn't supported between two devices
+    it's skipped for every later file on that same pair of devices. Any other backend name forces that one strategy,
+    which is handy for benchmarking. "shutil" is plain shutil.copy2 for comparison.
+
+    Files of at least large_file_threshold bytes that aren't reflinked are preallocated and copied in chunk_size byte
+    ranges. If a chunk_pool is given the ranges are copied in parallel on it. The chunk pool must be separate from
+    the pool calling copy(), since copy() waits on it.
+    """
+    def __init__(self, name="auto", chunk_size=CHUNK_SIZE, large_file_threshold=LARGE_FILE_THRESHOLD, chunk_pool=None) -> None:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown copy backend {name!r}, expected one of: {', '.join(BACKENDS)}")
+
+        self.name = name
+        self.order = AUTO_ORDER if name == "auto" else (name,)
+        self.chunk_size = chunk_size
+        self.large_file_threshold = large_file_threshold
+        self.chunk_pool = chunk_pool
+        # (src st_dev, dst st_dev) -> strategies that didn't work between them
+        self.unsupported = {}
+        self.lock = threading.Lock()
+        # strategy -> files it copied, so a benchmark can tell what "auto" actually picked
+        self.used = {}
+
+    def copy(self, src, dst, follow_symlinks=False) -> int:
+        """
+        Copy src to dst including permissions and timestamps (like shutil.copy2). Returns the number of bytes copied.
+        """
+        if self.name == "shutil":
+            shutil.copy2(src, dst, follow_symlinks=follow_symlinks)
+            self.count("shutil")
+            return os.stat(dst).st_size
+
+        if not follow_symlinks and os.path.islink(src):
+            os.symlink(os.readlink(src), dst)
+            self.count("symlink")
+            return 0
+
+        src_fd = os.open(src, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            st = os.fstat(src_fd)
+            dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), st.st_mode & 0o777)
+            try:
+                self.copy_fds(src_fd, dst_fd, st)
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+
+        shutil.copystat(src, dst, follow_symlinks=follow_symlinks)
+        return st.st_size
+
+    def copy_fds(self, src_fd, dst_fd, st) -> str:
+        key = (st.st_dev, os.fstat(dst_fd).st_dev)
+        skip = self.unsupported.get(key, ())
+
+        for strategy in self.order:
+            if strategy in skip:
+                continue
+            try:
+                if st.st_size >= self.large_file_threshold and strategy in RANGE_STRATEGIES:
+                    self.copy_chunked(src_fd, dst_fd, st.st_size, strategy)
+                else:
+                    STRATEGIES[strategy](src_fd, dst_fd, st.st_size)
+            except UnsupportedStrategy:
+                if len(self.order) == 1:
+                    raise UnsupportedBackend(errno.EOPNOTSUPP, f"The {strategy} copy backend isn't supported here")
+                with self.lock:
+                    self.unsupported.setdefault(key, set()).add(strategy)
+                # Whatever the failed strategy managed to do is thrown away
+                os.lseek(src_fd, 0, os.SEEK_SET)
+                os.ftruncate(dst_fd, 0)
+                os.lseek(dst_fd, 0, os.SEEK_SET)
+                continue
+
+            self.count(strategy)
+            return strategy
+
+        raise OSError(errno.EOPNOTSUPP, "No copy backend worked")
+
+    def copy_chunked(self, src_fd, dst_fd, size, strategy) -> None:
+        preallocate(dst_fd, size)
+
+        copy_range = RANGE_STRATEGIES[strategy]
+        ranges = [(offset, min(self.chunk_size, size - offset)) for offset in range(0, size, self.chunk_size)]
+
+        if self.chunk_pool is None or len(ranges) == 1:
+            for offset, length in ranges:
+                copy_range(src_fd, dst_fd, offset, length)
+            return
+
+        futures = [self.chunk_pool.submit(copy_range, src_fd, dst_fd, offset, length) for offset, length in ranges]
+        # Wait for every range before raising, so a fallback never races with ranges that are still being written
+        wait(futures)
+        for future in futures:
+            future.result()
+
+    def count(self, strategy) -> None:
+        with self.lock:
+            self.used[strategy] = self.used.get(strategy, 0) + 1
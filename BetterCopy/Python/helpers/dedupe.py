@@ -0,0 +1,142 @@
+import filecmp
+import os
+import shutil
+import threading
+import zlib
+
+from helpers.backends import reflink, UnsupportedStrategy
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# crc32 is only good enough to rule files out, so matches are confirmed byte for byte. xxh3 isn't.
+VERIFY_MATCHES = xxhash is None
+
+
+def fast_hash(filepath) -> int:
+    """
+    A fast non-cryptographic content hash: xxh3_64 if the xxhash package is installed, crc32 otherwise.
+    """
+    with open(filepath, "rb") as f:
+        if xxhash is not None:
+            h = xxhash.xxh3_64()
+            while chunk := f.read(HASH_CHUNK_SIZE):
+                h.update(chunk)
+            return h.intdigest()
+
+        crc = 0
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+        return crc
+
+
+class Original:
+    """
+    A file this run really copied, that later files with the same content can be linked to.
+    """
+    __slots__ = ("src", "dst", "digest", "ready", "ok")
+
+    def __init__(self, src, dst, digest=None) -> None:
+        self.src = src
+        self.dst = dst
+        # Only computed once another file of the same size shows up
+        self.digest = digest
+        # Set once the copy finished (or failed, then ok stays False)
+        self.ready = threading.Event()
+        self.ok = False
+
+
+class Deduper:
+    """
+    Copies each distinct file content once per run and turns later duplicates into hardlinks (or reflinks) of that
+    first copy.
+
+    Files are grouped by size first. A file is only hashed when another file of the same size has already been seen,
+    so a tree without duplicates costs no extra reads. Safe to call from several copy workers at once.
+    """
+    def __init__(self, link="hardlink") -> None:
+        if link not in ("hardlink", "reflink"):
+            raise ValueError(f"Unknown dedupe link type {link!r}, expected hardlink or reflink")
+
+        self.link_type = link
+        self.lock = threading.Lock()
+        # size -> Originals of that size
+        self.by_size = {}
+        self.files_linked = 0
+        self.bytes_saved = 0
+
+    def claim(self, src, dst, size) -> tuple[Original | None, Original | None]:
+        """
+        Returns (entry, None) if src has to be copied, entry being what later duplicates will link to, or
+        (None, original) if src has the same content as a file that's already being copied.
+        """
+        with self.lock:
+            group = self.by_size.get(size)
+            if group is None:
+                entry = Original(src, dst)
+                self.by_size[size] = [entry]
+                return entry, None
+            candidates = list(group)
+
+        # Hashing happens outside the lock. Two workers hashing the same original both store the same value.
+        digest = fast_hash(src)
+        for c in candidates:
+            if c.digest is None:
+                c.digest = fast_hash(c.src)
+
+        with self.lock:
+            for c in self.by_size[size]:
+                if c.digest == digest:
+                    return None, c
+            entry = Original(src, dst, digest)
+            self.by_size[size].append(entry)
+            return entry, None
+
+    def place(self, src, dst, size, copy) -> int:
+        """
+        Put src's content at dst, either by calling copy() or by linking to an identical file copied earlier.
+        Returns the bytes copied (0 when linked).
+        """
+        entry, original = self.claim(src, dst, size)
+
+        if original is not None:
+            original.ready.wait()
+            if original.ok and (not VERIFY_MATCHES or filecmp.cmp(src, original.src, shallow=False)) and self.link(src, original.dst, dst):
+                with self.lock:
+                    self.files_linked += 1
+                    self.bytes_saved += size
+                return 0
+            return copy()
+
+        try:
+            n = copy()
+            entry.ok = True
+            return n
+        finally:
+            entry.ready.set()
+
+    def link(self, src, target, dst) -> bool:
+        """
+        Make dst a link to target. Returns False if that isn't possible here (different filesystem, too many links,
+        no reflink support, ...) so the caller can copy instead.
+        """
+        head, tail = os.path.split(dst)
+        tmp = os.path.join(head, f".{tail}.bctmp")
+        try:
+            if self.link_type == "hardlink":
+                os.link(target, tmp)
+            else:
+                with open(target, "rb") as t, open(tmp, "wb") as d:
+                    reflink(t.fileno(), d.fileno(), 0)
+                # Unlike a hardlink, a reflink is its own file, so give it src's permissions and timestamps
+                shutil.copystat(src, tmp)
+            os.replace(tmp, dst)
+            return True
+        except (OSError, UnsupportedStrategy):
+            if os.path.lexists(tmp):
+                os.remove(tmp)
+            return False
@@ -0,0 +1,291 @@
+import re
+
+
+class IgnorePattern:
+    """
+    A single parsed line of a .bcignore/.gitignore file.
+
+    index is the line's position among the patterns. When several patterns match a path, the one with the highest
+    index wins, which is how gitignore lets a later "!pattern" re-include something an earlier line excluded.
+    """
+    __slots__ = ("pattern", "index", "negate", "dir_only", "anchored")
+
+    def __init__(self, pattern: str, index: int, negate: bool, dir_only: bool, anchored: bool) -> None:
+        self.pattern = pattern
+        self.index = index
+        self.negate = negate
+        self.dir_only = dir_only
+        self.anchored = anchored
+
+    def __repr__(self) -> str:
+        return f"IgnorePattern({self.pattern!r}, index={self.index}, negate={self.negate}, dir_only={self.dir_only}, anchored={self.anchored})"
+
+
+GLOB_CHARS = set("*?[\\")
+
+
+def parse_line(line: str, index: int) -> IgnorePattern | None:
+    """
+    Parse one ignore file line. Returns None for blank lines and comments.
+    """
+    line = line.rstrip("\r\n")
+
+    # Trailing spaces are ignored unless they're escaped with a backslash
+    while line.endswith(" ") and not line.endswith("\\ "):
+        line = line[:-1]
+
+    if not line or line.startswith("#"):
+        return None
+
+    negate = False
+    if line.startswith("!"):
+        negate = True
+        line = line[1:]
+    elif line.startswith("\\!") or line.startswith("\\#"):
+        line = line[1:]
+
+    dir_only = False
+    if line.endswith("/"):
+        dir_only = True
+        line = line.rstrip("/")
+
+    # A slash at the start or in the middle anchors the pattern to the directory the ignore file lives in.
+    # Otherwise it can match at any level.
+    anchored = "/" in line
+    line = line.lstrip("/")
+
+    if not line:
+        return None
+
+    return IgnorePattern(line, index, negate, dir_only, anchored)
+
+
+def glob_to_regex(pattern: str) -> str:
+    """
+    Translate a gitignore glob into a regex body that matches a whole "/" separated relative path.
+    Only non-capturing groups are used so the caller can wrap the result in a named group.
+    """
+    out = []
+    i = 0
+    n = len(pattern)
+
+    while i < n:
+        c = pattern[i]
+
+        if c == "*":
+            if pattern.startswith("**", i):
+                at_start = i == 0 or pattern[i - 1] == "/"
+                at_end = i + 2 == n
+                followed_by_slash = i + 2 < n and pattern[i + 2] == "/"
+
+                if at_start and followed_by_slash:
+                    # "**/" matches zero or more directories
+                    out.append("(?:.*/)?")
+                    i += 3
+                    continue
+                if at_start and at_end:
+                    # "/**" matches everything inside
+                    out.append(".*")
+                    i += 2
+                    continue
+
+                # Any other run of asterisks is just a regular "*"
+                while i < n and pattern[i] == "*":
+                    i += 1
+                out.append("[^/]*")
+                continue
+
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = i + 1
+            if j < n and pattern[j] in "!^":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+
+            if j >= n:
+                # No closing bracket, so it's a literal "["
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j]
+                if body[:1] in ("!", "^"):
+                    body = "^" + body[1:]
+                out.append(f"(?!/)[{body.replace(chr(92), chr(92) * 2)}]")
+                i = j
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+
+        i += 1
+
+    return "".join(out)
+
+
+def literal_prefix(pattern: str) -> str:
+    for i, c in enumerate(pattern):
+        if c in GLOB_CHARS:
+            return pattern[:i]
+    return pattern
+
+
+def read_ignore_file(filepath) -> list[str]:
+    with open(filepath, "r") as f:
+        return f.read().splitlines()
+
+
+class IgnoreMatcher:
+    """
+    Compiles a list of .bcignore/.gitignore lines once so that checking a path doesn't cost a glob match per pattern.
+
+    Patterns are sorted into buckets by shape:
+        - literal basenames ("node_modules", "a_folder") -> dict lookup on the entry name
+        - literal anchored paths ("/build", "docs/tmp") -> dict lookup on the relative path
+        - suffix globs ("*.pyc", "*~") -> dict lookup on the last N characters of the name
+        - other globs without a "/" -> combined regexes run against the name
+        - everything else -> combined regexes run against the relative path
+    Globs that start with a literal prefix ("file_*.c", "docs/**/*.md") are further split by that prefix, so only the
+    few regexes whose prefix matches are ever run. Directory-only patterns ("build/") get their own regexes that are
+    only consulted for directories.
+
+    Paths passed to is_ignored() are relative to the directory holding the ignore file and use "/" as the separator.
+    Like git, a path inside an ignored directory is only excluded because the walker never descends into that
+    directory, so callers walking top-down should prune ignored directories.
+    """
+    def __init__(self, lines: list[str]) -> None:
+        self.patterns = []
+        for line in lines:
+            p = parse_line(line, len(self.patterns))
+            if p is not None:
+                self.patterns.append(p)
+
+        self.has_negations = any(p.negate for p in self.patterns)
+
+        self.literals = {}
+        self.paths = {}
+        self.suffixes = {}
+        globs = []
+
+        for p in self.patterns:
+            if not any(c in GLOB_CHARS for c in p.pattern):
+                bucket = self.paths if p.anchored else self.literals
+                bucket.setdefault(p.pattern, []).append(p)
+            elif not p.anchored and p.pattern.startswith("*") and not any(c in GLOB_CHARS for c in p.pattern[1:]) and len(p.pattern) > 1:
+                suffix = p.pattern[1:]
+                self.suffixes.setdefault(len(suffix), {}).setdefault(suffix, []).append(p)
+            else:
+                globs.append(p)
+
+        # Highest index first so the first applicable candidate in a bucket is the winner for that bucket
+        for bucket in [self.literals, self.paths, *self.suffixes.values()]:
+            for candidates in bucket.values():
+                candidates.sort(key=lambda p: p.index, reverse=True)
+        self.suffixes = sorted(self.suffixes.items())
+
+        # (matches against the name instead of the full path, only for directories, prefix tables, regex for the rest)
+        self.by_group = {}
+        self.glob_groups = []
+        for on_name in (True, False):
+            for dir_only in (False, True):
+                group = [p for p in globs if (not p.anchored) == on_name and p.dir_only == dir_only]
+                if not group:
+                    continue
+
+                by_prefix = {}
+                no_prefix = []
+                for p in group:
+                    prefix = literal_prefix(p.pattern)
+                    if prefix:
+                        by_prefix.setdefault(len(prefix), {}).setdefault(prefix, []).append(p)
+                    else:
+                        no_prefix.append(p)
+
+                prefix_tables = sorted(
+                    (length, {prefix: self.compile_globs(patterns) for prefix, patterns in table.items()})
+                    for length, table in by_prefix.items()
+                )
+                self.glob_groups.append((on_name, dir_only, prefix_tables, self.compile_globs(no_prefix)))
+
+    @classmethod
+    def from_file(cls, filepath) -> "IgnoreMatcher":
+        return cls(read_ignore_file(filepath))
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def compile_globs(self, patterns: list[IgnorePattern]):
+        if not patterns:
+            return None
+
+        # The regex engine takes the first alternative that matches, so putting the highest index first means the
+        # group that matched is the pattern that wins.
+        parts = []
+        for p in sorted(patterns, key=lambda p: p.index, reverse=True):
+            body = glob_to_regex(p.pattern)
+            group = f"p{p.index}"
+            self.by_group[group] = p
+            parts.append(f"(?P<{group}>{body})")
+
+        return re.compile("|".join(parts), re.DOTALL)
+
+    def pick_regex(self, regex, s, best):
+        if regex is not None:
+            m = regex.fullmatch(s)
+            if m is not None:
+                p = self.by_group[m.lastgroup]
+                if best is None or p.index > best.index:
+                    return p
+        return best
+
+    def pick(self, candidates, is_dir, best):
+        if candidates:
+            for p in candidates:
+                if is_dir or not p.dir_only:
+                    if best is None or p.index > best.index:
+                        return p
+                    break
+        return best
+
+    def match(self, rel_path: str, is_dir=False) -> IgnorePattern | None:
+        """
+        Returns the pattern that decides rel_path, or None if no pattern matches it.
+        """
+        name = rel_path.rpartition("/")[2]
+        best = None
+
+        best = self.pick(self.literals.get(name), is_dir, best)
+        if best is not None and not self.has_negations:
+            return best
+
+        best = self.pick(self.paths.get(rel_path), is_dir, best)
+        if best is not None and not self.has_negations:
+            return best
+
+        for length, table in self.suffixes:
+            if length > len(name):
+                break
+            best = self.pick(table.get(name[-length:]), is_dir, best)
+            if best is not None and not self.has_negations:
+                return best
+
+        for on_name, dir_only, prefix_tables, regex in self.glob_groups:
+            if dir_only and not is_dir:
+                continue
+
+            s = name if on_name else rel_path
+            for length, table in prefix_tables:
+                if length > len(s):
+                    break
+                best = self.pick_regex(table.get(s[:length]), s, best)
+            best = self.pick_regex(regex, s, best)
+
+        return best
+
+    def is_ignored(self, rel_path: str, is_dir=False) -> bool:
+        p = self.match(rel_path, is_dir)
+        return p is not None and not p.negate
@@ -0,0 +1,94 @@
+import ctypes
+import json
+import os
+import time
+
+JOURNAL_NAME = ".bcjournal"
+
+
+def load_syncfs():
+    """
+    libc's syncfs(fd), which flushes the one filesystem fd is on instead of every filesystem on the host like
+    os.sync(). None where there's no such call (anything but Linux).
+    """
+    try:
+        return ctypes.CDLL(None, use_errno=True).syncfs
+    except (OSError, AttributeError):
+        return None
+
+
+SYNCFS = load_syncfs()
+
+
+class Journal:
+    """
+    Append-only log of what a directory copy has finished, so an interrupted run can be picked up with --resume.
+
+    Each line is a JSON list: ["F", rel_path] for a file that's fully in place, ["D", rel_path] for a folder whose
+    whole subtree is done (so a resumed walk doesn't even open it). Lines are buffered and only flushed and fsync'ed
+    every sync_every entries or sync_interval seconds. Before that the file data is synced too, with syncfs() on dst's
+    filesystem (os.sync() where there's no syncfs), so the journal never names a file that isn't on disk yet. A torn last line from a crash is ignored when loading.
+
+    The journal is deleted once a run finishes.
+    """
+    def __init__(self, dst, sync_every=1000, sync_interval=2.0) -> None:
+        self.path = os.path.join(dst, JOURNAL_NAME)
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.f = None
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def load(self) -> tuple[set[str], set[str]] | None:
+        """
+        Returns the (files, folders) a previous run finished, or None if there's no journal.
+        """
+        if not os.path.isfile(self.path):
+            return None
+
+        files = set()
+        folders = set()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    kind, rel_path = json.loads(line)
+                except ValueError:
+                    continue
+                (files if kind == "F" else folders).add(rel_path)
+        return files, folders
+
+    def open(self, resume=False) -> None:
+        self.f = open(self.path, "a" if resume else "w", encoding="utf-8")
+
+    def file_done(self, rel_path) -> None:
+        self.write("F", rel_path)
+
+    def folder_done(self, rel_path) -> None:
+        self.write("D", rel_path)
+
+    def write(self, kind, rel_path) -> None:
+        self.f.write(json.dumps([kind, rel_path]) + "\n")
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self) -> None:
+        # The journal's own buffered lines are only flushed after this, so they can't reach the disk first
+        if SYNCFS is None or SYNCFS(self.f.fileno()) != 0:
+            if hasattr(os, "sync"):
+                os.sync()
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self, finished=False) -> None:
+        if self.f is None:
+            return
+        if finished:
+            self.f.close()
+            os.remove(self.path)
+        else:
+            self.sync()
+            self.f.close()
+        self.f = None
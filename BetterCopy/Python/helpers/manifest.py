@@ -0,0 +1,81 @@
+import os
+import sqlite3
+from contextlib import closing
+
+MANIFEST_NAME = ".bcmanifest"
+
+
+class Manifest:
+    """
+    What the last run copied into dst, keyed by the file's path relative to src.
+
+    Each row holds the size, mtime and inode the source file had when it was copied (and its content hash when
+    --checksum was used). An incremental run compares the source walk against these rows, so unchanged files are
+    skipped without ever stat'ing their copy in dst.
+
+    The rows are loaded into a dict up front. Workers only read from it and add to `updated`/`seen`, and everything is
+    written back in one transaction by save().
+    """
+    def __init__(self, dst) -> None:
+        self.path = os.path.join(dst, MANIFEST_NAME)
+        self.entries = {}
+        self.updated = {}
+        self.seen = set()
+
+    def load(self) -> bool:
+        if not os.path.isfile(self.path):
+            return False
+
+        try:
+            with closing(sqlite3.connect(self.path)) as db:
+                for path, size, mtime_ns, inode, digest in db.execute("SELECT path, size, mtime_ns, inode, hash FROM files"):
+                    self.entries[path] = (size, mtime_ns, inode, digest)
+        except sqlite3.DatabaseError:
+            # A corrupt/foreign manifest just means we fall back to comparing against dst
+            self.entries = {}
+            return False
+
+        return True
+
+    def covers(self, rel_path, checksum=False) -> bool:
+        """
+        Whether the manifest can decide on rel_path by itself. With --checksum that needs a stored hash.
+        """
+        entry = self.entries.get(rel_path)
+        return entry is not None and (not checksum or entry[3] is not None)
+
+    def unchanged(self, rel_path, st, digest=None) -> bool:
+        entry = self.entries.get(rel_path)
+        if entry is None:
+            return False
+
+        size, mtime_ns, inode, old_digest = entry
+        if size != st.st_size:
+            return False
+        if digest is not None:
+            return digest == old_digest
+        return mtime_ns == st.st_mtime_ns and inode == st.st_ino
+
+    def mark_seen(self, rel_path) -> None:
+        self.seen.add(rel_path)
+
+    def record(self, rel_path, st, digest=None) -> None:
+        self.updated[rel_path] = (st.st_size, st.st_mtime_ns, st.st_ino, digest)
+        self.seen.add(rel_path)
+
+    def removed(self) -> list[str]:
+        """
+        Paths the last run copied that this run didn't see in the source.
+        """
+        return [p for p in self.entries if p not in self.seen]
+
+    def save(self, prune=True) -> None:
+        """
+        Write this run's changes. prune drops rows for files that weren't seen, so only pass it once the whole
+        source has been walked.
+        """
+        with closing(sqlite3.connect(self.path)) as db, db:
+            db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, hash BLOB)")
+            if prune:
+                db.executemany("DELETE FROM files WHERE path = ?", ((p,) for p in self.removed()))
+            db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", ((p, *v) for p, v in self.updated.items()))
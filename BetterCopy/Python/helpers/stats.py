@@ -0,0 +1,115 @@
+import json
+import sys
+import threading
+import time
+
+MB = 1024 * 1024
+
+COUNTERS = ("entries", "ignored", "dirs", "files", "bytes", "skipped", "resumed", "linked", "saved", "deleted")
+PHASES = ("walk", "match", "mkdir", "copy")
+
+
+class Stats:
+    """
+    Counters and per-phase timers for one run.
+
+    Counters:
+        entries  directory entries the walker looked at
+        ignored  entries left out by the ignore patterns (or -d)
+        dirs     directories listed
+        files    files copied (or written to the archive)
+        bytes    bytes copied
+        skipped  files that were already up to date
+        resumed  files an interrupted run had already copied
+        linked   duplicates linked instead of copied, saved is the bytes that saved
+        deleted  files/folders removed from dst
+
+    Phases are seconds spent listing directories (walk, not counting match), in the ignore matcher (match),
+    creating destination folders (mkdir) and copying files (copy). copy is summed over all workers, so with --jobs
+    it can be more than the wall time. If walk + match + mkdir is most of the run it's bound by metadata, if copy is
+    it's bound by bandwidth.
+
+    Callers time whole directories or batches and add them once, so this costs next to nothing per file. Anything
+    that's added to from several threads goes through add(), which takes a lock.
+    """
+    def __init__(self, progress=False, interval=0.5, out=sys.stderr) -> None:
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.end = None
+        # The progress line is only drawn on a terminal, a log file would just fill up with carriage returns
+        self.progress = progress and out.isatty()
+        self.interval = interval
+        self.out = out
+        self.last_draw = 0.0
+        self.drawn = False
+
+    def add(self, counter=None, n=1, phase=None, seconds=0.0) -> None:
+        with self.lock:
+            if counter is not None:
+                self.counters[counter] += n
+            if phase is not None:
+                self.phases[phase] += seconds
+
+    def elapsed(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def tick(self) -> None:
+        """
+        Redraw the progress line if it's on and the last redraw was at least interval seconds ago. Cheap enough to
+        call after every file.
+        """
+        if not self.progress:
+            return
+        now = time.monotonic()
+        if now - self.last_draw < self.interval:
+            return
+        self.last_draw = now
+        self.out.write(f"\r{self.progress_line()}\033[K")
+        self.out.flush()
+        self.drawn = True
+
+    def progress_line(self) -> str:
+        c = self.counters
+        elapsed = max(self.elapsed(), 1e-9)
+        mb = c["bytes"] / MB
+        line = f"{c['files']} files, {mb:.1f} MB copied"
+        if c["skipped"]:
+            line += f", {c['skipped']} skipped"
+        return f"{line} | {c['files'] / elapsed:.0f} files/s, {mb / elapsed:.1f} MB/s | {c['entries']} entries walked"
+
+    def finish(self) -> None:
+        """
+        Stop the clock and clear the progress line so the summary prints on a clean line.
+        """
+        self.end = time.perf_counter()
+        if self.drawn:
+            self.out.write("\r\033[K")
+            self.out.flush()
+            self.drawn = False
+
+    def to_dict(self) -> dict:
+        elapsed = max(self.elapsed(), 1e-9)
+        return {
+            "elapsed": round(elapsed, 6),
+            "counters": dict(self.counters),
+            "phases": {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            "rates": {
+                "files_per_s": round(self.counters["files"] / elapsed, 3),
+                "mb_per_s": round(self.counters["bytes"] / MB / elapsed, 3),
+                "entries_per_s": round(self.counters["entries"] / elapsed, 3),
+            },
+        }
+
+    def dump_json(self, path) -> None:
+        """
+        Write to_dict() as JSON to path, or to stdout if path is "-".
+        """
+        if path == "-":
+            json.dump(self.to_dict(), sys.stdout, indent=2)
+            sys.stdout.write("\n")
+            return
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+            f.write("\n")
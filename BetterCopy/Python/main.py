@@ -1,29 +1,49 @@
 import argparse
 import glob
+import hashlib
 import os
 import shutil
+import stat
 import ntpath
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 
+from helpers.ignore import IgnoreMatcher, read_ignore_file
+from helpers.archive import ArchiveWriter, archive_format, iter_archive_items, missing_module
+from helpers.backends import CopyBackend, BACKENDS, CHUNK_SIZE, LARGE_FILE_THRESHOLD, UnsupportedBackend
+from helpers.dedupe import Deduper
+from helpers.journal import Journal, JOURNAL_NAME
+from helpers.manifest import Manifest, MANIFEST_NAME
+from helpers.stats import Stats
+
 
 class FileTree:
-    def __init__(self, base_path: str, depth: int, include_patterns: list[str], exclude_patterns: list[str]) -> None:
+    def __init__(self, base_path: str, depth: int, include_patterns: list[str], exclude_patterns: list[str], scan=True, matcher=None, rel_path="") -> None:
         self.base_path = base_path
         self.include_patterns = include_patterns
         self.exclude_patterns = exclude_patterns
+        # The ignore patterns are compiled once at the root and shared by every subtree
+        self.matcher = matcher if matcher is not None else IgnoreMatcher(exclude_patterns)
+        # Path relative to the root of the walk, "/" separated. "" for the root itself
+        self.rel_path = rel_path
         self.folders = []
+        # File names (not paths) directly inside base_path
         self.files = []
         self.depth = depth
 
-        self.ls()
+        if scan:
+            self.ls()
 
     def abs_path(self, rel_path) -> str:
         return os.path.join(self.base_path, rel_path)
 
-    def pattern_matcher(self, s) -> bool:
+    def pattern_matcher(self, rel_path, is_dir=False) -> bool:
         # in_include_patterns = all(not s.match(x) for x in self.include_patterns)
         # in_exclude_patterns = all(not s.match(x) for x in self.exclude_patterns)
-        return all(not s.match(x) for x in self.exclude_patterns)
+        return not self.matcher.is_ignored(rel_path, is_dir)
         # We return it this way so that in_include_patterns takes precedence.
         # return True if in_include_patterns else in_exclude_patterns
 
@@ -60,21 +80,171 @@ class FileTree:
             self.pretty_print_file_helper(pretty_path, temp_folder.files, temp_folder.depth, original_base_path)
 
     def ls(self):
-        path_obj = self.str_to_path(self.base_path)
-        if not path_obj.is_dir():
-            self.print_error_with_verbosity("Please provide a valid dir!")
-            return None
-
-        for p in path_obj.iterdir():
-            if self.pattern_matcher(p):
-                if p.is_file():
-                    self.files.append(p)
-                elif p.is_dir():
-                    f = FileTree(p, self.depth + 1, self.include_patterns, self.exclude_patterns)
-                    self.folders.append(f)
-                else:
-                    self.print_error_with_verbosity(f"Unaccepted file/folder type at: {p}")
-
+        # Materialize the tree from the same walker the copy streams from. Only the nodes that haven't been
+        # listed yet are kept in `nodes`.
+        nodes = {self.rel_path: self}
+        for d in walk(self.base_path, self.matcher, rel_path=self.rel_path, depth=self.depth):
+            node = nodes.pop(d.rel_path)
+            node.files = d.files
+            for name in d.folders:
+                rel_path = f"{d.rel_path}/{name}" if d.rel_path else name
+                f = FileTree(os.path.join(d.path, name), d.depth + 1, self.include_patterns, self.exclude_patterns, scan=False, matcher=self.matcher, rel_path=rel_path)
+                node.folders.append(f)
+                nodes[rel_path] = f
+
+
+class WalkDir:
+    """
+    One directory as listed by walk(): where it is, and the names of the files and folders in it that aren't ignored.
+    error is the OSError if it couldn't be (fully) listed, the lists then only hold what was read before that.
+    """
+    __slots__ = ("path", "rel_path", "depth", "files", "folders", "error")
+
+    def __init__(self, path: str, rel_path: str, depth: int) -> None:
+        self.path = path
+        # "/" separated, relative to the root of the walk. "" for the root itself
+        self.rel_path = rel_path
+        self.depth = depth
+        self.files = []
+        self.folders = []
+        self.error = None
+
+
+def walk(base_path: str, matcher: IgnoreMatcher, rel_path="", depth=0, max_depth=None, prune=(), exclude=(), stats: Stats = None, on_error=None):
+    """
+    Yield a WalkDir for base_path and every directory under it that isn't ignored. Parents come before children.
+
+    With max_depth, directories deeper than that are left out of their parent's folders and never opened, so a
+    shallow walk of a huge tree only costs as much as the levels it lists. base_path is depth 0.
+
+    Folders whose relative path is in prune are still listed in their parent's folders, but never opened. --resume
+    uses this for subtrees the journal says are already done. Paths in exclude are left out completely, as if they
+    were ignored. BetterCopy uses it for a dst inside src, which would otherwise be walked while it's being written.
+
+    One os.scandir() pass per directory. The DirEntry already knows its type, so entries aren't stat'ed again, and
+    subdirectories go on an explicit stack instead of recursing so deep trees can't hit the recursion limit. Only
+    directories that are still waiting to be listed are held in memory, never the whole tree.
+
+    With stats, the time spent listing and matching each directory is added to its walk and match phases.
+
+    on_error is called with a message for every directory that can't be read and every entry that isn't a file or
+    folder. BetterCopy passes its print_error_with_verbosity(), so -q silences them like any other error.
+    """
+    if on_error is None:
+        on_error = lambda msg: None
+
+    if not os.path.isdir(base_path):
+        on_error(f"Please provide a valid dir! {base_path}")
+        return
+
+    is_ignored = matcher.is_ignored
+    match_time = 0.0
+    if stats is not None:
+        def is_ignored(rel_path, is_dir=False):
+            nonlocal match_time
+            t = time.perf_counter()
+            try:
+                return matcher.is_ignored(rel_path, is_dir)
+            finally:
+                match_time += time.perf_counter() - t
+
+    stack = [WalkDir(base_path, rel_path, depth)]
+    while stack:
+        d = stack.pop()
+        prefix = f"{d.rel_path}/" if d.rel_path else ""
+        start = time.perf_counter()
+        match_time = 0.0
+        entries = 0
+        try:
+            with os.scandir(d.path) as it:
+                for entry in it:
+                    rel_path = prefix + entry.name
+                    entries += 1
+                    if exclude and rel_path in exclude:
+                        continue
+
+                    if entry.is_file():
+                        if not is_ignored(rel_path):
+                            d.files.append(entry.name)
+                    elif entry.is_dir():
+                        if max_depth is not None and d.depth >= max_depth:
+                            continue
+                        # An ignored directory is never opened, so nothing below it costs anything
+                        if is_ignored(rel_path, is_dir=True):
+                            continue
+                        d.folders.append(entry.name)
+                        if rel_path not in prune:
+                            stack.append(WalkDir(entry.path, rel_path, d.depth + 1))
+                    else:
+                        on_error(f"Unaccepted file/folder type at: {entry.path}")
+        except OSError as e:
+            d.error = e
+            on_error(f"Unable to read {d.path}: {e}")
+
+        if stats is not None:
+            stats.add("entries", entries, "walk", time.perf_counter() - start - match_time)
+            stats.add("ignored", entries - len(d.files) - len(d.folders), "match", match_time)
+            stats.add("dirs")
+        yield d
+
+
+class SyncOptions:
+    """
+    The per-run settings every file copy needs, so they can be handed to workers in one piece.
+    """
+    __slots__ = ("follow_symlinks", "incremental", "checksum", "manifest", "backend", "atomic", "deduper", "stats")
+
+    def __init__(self, follow_symlinks=False, incremental=False, checksum=False, manifest=None, backend=None, atomic=False, deduper=None, stats=None) -> None:
+        self.follow_symlinks = follow_symlinks
+        self.incremental = incremental
+        self.checksum = checksum
+        self.manifest = manifest
+        self.backend = backend
+        self.atomic = atomic
+        self.deduper = deduper
+        self.stats = stats
+
+
+def prefetch(iterable, maxsize):
+    """
+    Run iterable on a background thread and yield its items through a queue of at most maxsize items. The walker
+    keeps listing directories while the main thread waits on copies, but can never run more than maxsize ahead.
+    """
+    q = queue.Queue(maxsize)
+    stop = threading.Event()
+    end = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def producer():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put((end, None))
+        except BaseException as e:
+            put((end, e))
+
+    threading.Thread(target=producer, daemon=True).start()
+
+    try:
+        while True:
+            item = q.get()
+            if type(item) is tuple and item[0] is end:
+                if item[1] is not None:
+                    raise item[1]
+                return
+            yield item
+    finally:
+        # Unblocks the producer if we stopped early
+        stop.set()
 
 
 # From: https://stackoverflow.com/a/287944/9297141
@@ -110,58 +280,410 @@ class Helpers:
         with open(filepath, "r") as f:
             return [line.strip() for line in f if "#" not in line]
 
-    def build_folder_structure(self, src, include_patterns, exclude_patterns, max_depth=None) -> list[FileTree]:
-        done = False
-        curr_depth = 0
-        root = FileTree(src, 0, include_patterns, exclude_patterns)
-        q = [root]
-        next_q = []
-        s = {
-            0: []
-        }
-
-        while not done:
-            if len(q) > 0:
-                temp = q.pop()
-            
-                if not max_depth:
-                    f = FileTree(temp, curr_depth, include_patterns, exclude_patterns)
-                    next_q.append(f)
-                    s[curr_depth].append(f)
-                elif curr_depth <= max_depth:
-                    f = FileTree(temp, curr_depth, include_patterns, exclude_patterns)
-                    next_q.append(f)
-                    s[curr_depth].append(f)
+    def pretty_print_dirs(self, dirs) -> None:
+        for d in dirs:
+            print(f"{'  ' * d.depth}| /{d.rel_path}")
+            for f in d.files:
+                print(f"{'  ' * d.depth}    - {f}")
+
+    def copy_file(self, src, dst, follow_symlinks=False, backend=None, atomic=False) -> int:
+        if atomic:
+            # Write next to dst and rename over it, so dst is either the old file or the complete new one
+            head, tail = os.path.split(dst)
+            tmp = os.path.join(head, f".{tail}.bctmp")
+            try:
+                size = self.copy_file(src, tmp, follow_symlinks, backend)
+                try:
+                    os.replace(tmp, dst)
+                except OSError:
+                    if not self.remove_folder_in_the_way(dst):
+                        raise
+                    os.replace(tmp, dst)
+            except BaseException:
+                if os.path.lexists(tmp):
+                    os.remove(tmp)
+                raise
+            return size
+
+        # dst may be a hardlink --dedupe made on an earlier run. Writing into it would change every other name of that
+        # inode too, so the old file is unlinked and a new one created in its place.
+        try:
+            os.unlink(dst)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            if not self.remove_folder_in_the_way(dst):
+                raise
+
+        # Both paths keep the source mtime, which is what --incremental compares against on the next run
+        if backend is not None:
+            return backend.copy(src, dst, follow_symlinks)
+        shutil.copy2(src, dst, follow_symlinks=follow_symlinks)
+        return os.stat(dst).st_size
+
+    def remove_folder_in_the_way(self, dst) -> bool:
+        """
+        The source has a file where the last copy had a folder. Removes that folder, returns False if dst isn't one.
+        """
+        if os.path.islink(dst) or not os.path.isdir(dst):
+            return False
+        shutil.rmtree(dst)
+        return True
+
+    def file_hash(self, filepath, chunk_size=1024 * 1024) -> bytes:
+        h = hashlib.blake2b(digest_size=16)
+        with open(filepath, "rb") as f:
+            while chunk := f.read(chunk_size):
+                h.update(chunk)
+        return h.digest()
+
+    def file_changed(self, src, dst, follow_symlinks=False, checksum=False, src_stat=None, src_digest=None) -> bool:
+        try:
+            dst_stat = os.stat(dst, follow_symlinks=follow_symlinks)
+        except FileNotFoundError:
+            return True
+
+        if stat.S_ISDIR(dst_stat.st_mode):
+            return True
+
+        if src_stat is None:
+            src_stat = os.stat(src, follow_symlinks=follow_symlinks)
+        if src_stat.st_size != dst_stat.st_size:
+            return True
+
+        if checksum:
+            return (src_digest or self.file_hash(src)) != self.file_hash(dst)
+
+        # Whole seconds, like rsync, so destinations with coarser timestamps don't get recopied every run
+        return int(src_stat.st_mtime) != int(dst_stat.st_mtime)
+
+    def place_file(self, src, dst, opts: SyncOptions, src_stat=None) -> int:
+        def copy():
+            return self.copy_file(src, dst, opts.follow_symlinks, opts.backend, opts.atomic)
+
+        if opts.deduper is None or (not opts.follow_symlinks and os.path.islink(src)):
+            return copy()
+
+        if src_stat is None:
+            src_stat = os.stat(src, follow_symlinks=opts.follow_symlinks)
+        return opts.deduper.place(src, dst, src_stat.st_size, copy)
+
+    def sync_file(self, src, dst, rel_path, opts: SyncOptions) -> int | None:
+        """
+        Copy src to dst and return the number of bytes copied, or None if dst was already up to date.
+
+        When the manifest from the last run says src hasn't changed since it was copied, dst isn't looked at at all.
+        """
+        follow_symlinks = opts.follow_symlinks
+        incremental = opts.incremental
+        checksum = opts.checksum
+        manifest = opts.manifest
+
+        if manifest is None:
+            if incremental and not self.file_changed(src, dst, follow_symlinks, checksum):
+                return None
+            return self.place_file(src, dst, opts)
+
+        src_stat = os.stat(src, follow_symlinks=follow_symlinks)
+        digest = self.file_hash(src) if checksum else None
+
+        if incremental:
+            if manifest.unchanged(rel_path, src_stat, digest):
+                manifest.mark_seen(rel_path)
+                return None
+            if not manifest.covers(rel_path, checksum) and not self.file_changed(src, dst, follow_symlinks, checksum, src_stat, digest):
+                # The manifest doesn't know this file (or has no hash for it), but dst already matches
+                manifest.record(rel_path, src_stat, digest)
+                return None
+
+        size = self.place_file(src, dst, opts, src_stat)
+        manifest.record(rel_path, src_stat, digest)
+        return size
+
+    def sync_batch(self, batch, opts: SyncOptions) -> list[tuple[str, int | None]]:
+        # One pool task per batch of files, so tiny files don't each pay for a future and a queue round trip
+        start = time.perf_counter()
+        results = [(rel_path, self.sync_file(src, dst, rel_path, opts)) for src, dst, rel_path in batch]
+        if opts.stats is not None:
+            opts.stats.add(phase="copy", seconds=time.perf_counter() - start)
+        return results
+
+    def delete_extraneous(self, d: WalkDir, out_dir) -> int:
+        """
+        Remove everything in out_dir that isn't in the (filtered) source directory d, or is a file where d has a
+        folder or the other way round. Returns how many entries were removed.
+        """
+        files = set(d.files)
+        folders = set(d.folders)
+        if not d.rel_path:
+            files.update((MANIFEST_NAME, JOURNAL_NAME))
+
+        deleted = 0
+        with os.scandir(out_dir) as it:
+            for entry in it:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if entry.name in (folders if is_dir else files):
+                    continue
+                if is_dir:
+                    shutil.rmtree(entry.path)
                 else:
-                    done = True
-            else:
-                s[len(s)] = []
-                q = next_q[:]
-                next_q = []
-                curr_depth += 1
+                    os.remove(entry.path)
+                deleted += 1
+        return deleted
+
+    def delete_removed(self, dst, manifest: Manifest, folders=()) -> int:
+        """
+        Remove files the last run copied that are gone from the source, using the manifest instead of listing dst.
+        Folders that end up empty are removed too, unless they're in folders (the rel_paths the walk listed), since
+        an empty folder that's still in the source stays.
+        """
+        deleted = 0
+        for rel_path in manifest.removed():
+            if rel_path in folders:
+                # The file became a folder, which the copy already put in its place
+                continue
+            try:
+                os.remove(os.path.join(dst, rel_path))
+                deleted += 1
+            except (FileNotFoundError, NotADirectoryError):
+                # Gone already, or one of its folders became a file
+                continue
+
+            parent = os.path.dirname(rel_path)
+            while parent and parent not in folders:
+                try:
+                    os.rmdir(os.path.join(dst, parent))
+                except OSError:
+                    break
+                deleted += 1
+                parent = os.path.dirname(parent)
+        return deleted
+
+    def print_copy_summary(self, stats: Stats, curr_verbosity) -> None:
+        counts = stats.counters
+        elapsed = max(stats.elapsed(), 1e-9)
+        mb_copied = counts["bytes"] / (1024 * 1024)
+        msg = (f"Copied {counts['files']} files ({mb_copied:.2f} MB) in {elapsed:.2f}s: "
+               f"{counts['files'] / elapsed:.1f} files/s, {mb_copied / elapsed:.2f} MB/s")
+        if counts["skipped"]:
+            msg += f"\nSkipped {counts['skipped']} unchanged files"
+        if counts["resumed"]:
+            msg += f"\nResumed: {counts['resumed']} files were already copied by the interrupted run"
+        if counts["linked"]:
+            msg += f"\nDeduplicated {counts['linked']} files, saving {counts['saved'] / (1024 * 1024):.2f} MB"
+        if counts["deleted"]:
+            msg += f"\nDeleted {counts['deleted']} files/folders that are no longer in the source"
+        self.print_info_with_verbosity(msg, 1, curr_verbosity)
+
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in stats.phases.items())
+        self.print_info_with_verbosity(f"Walked {counts['entries']} entries in {counts['dirs']} folders ({counts['ignored']} left out). Time per phase: {phases}", 3, curr_verbosity)
+
+    def do_archive(self, src_dirs, dst, fmt, follow_symlinks=False, curr_verbosity=1, read_ahead=32, stats=None):
+        """
+        Stream the directories yielded by src_dirs straight into a tar/zip archive at dst, instead of copying to a
+        folder and archiving that. Files are read on the walker's thread, at most read_ahead chunks ahead, while this
+        thread compresses and writes.
+        """
+        if os.path.exists(dst):
+            self.print_error_with_verbosity(f"Path at {dst} already exists!", curr_verbosity)
+            exit(1)
 
-            
-        return s
+        if stats is None:
+            stats = Stats()
+        start = time.perf_counter()
+        with ArchiveWriter(dst, fmt) as writer:
+            writer.write_items(prefetch(iter_archive_items(src_dirs, follow_symlinks), read_ahead))
+        stats.add(phase="copy", seconds=time.perf_counter() - start)
+        stats.add("files", writer.files)
+        stats.add("bytes", writer.bytes)
+        stats.finish()
 
-    def do_deep_copy(self, root: FileTree, dst: str, follow_symlinks=False):
-        q = [root]
-        original_path = root.base_path
+        for rel_path, e in writer.errors:
+            self.print_error_with_verbosity(f"Unable to read {rel_path}: {e}", curr_verbosity)
 
-        if os.path.exists(dst):
-            self.print_error_with_verbosity(f"Path at {dst} already exists! Please use the -e/--allow-empty option to use an already existing directory!")
-            exit(1)
+        self.print_copy_summary(stats, curr_verbosity)
 
-        os.mkdir(dst)
+    def do_deep_copy(self, src_dirs, dst: str, follow_symlinks=False, jobs=1, curr_verbosity=1, incremental=False, checksum=False, delete=False, use_manifest=True, copy_backend="auto", batch_size=32, chunk_size=CHUNK_SIZE, large_file_threshold=LARGE_FILE_THRESHOLD, chunk_workers=1, queue_size=256, journal=None, finished=None, dedupe=None, full_walk=True, stats=None):
+        """
+        Copy the directories yielded by src_dirs (see walk()) into dst as they're listed, instead of building the
+        whole tree first. With jobs > 1 the walker runs on its own thread at most queue_size directories ahead, and
+        at most jobs * 4 batches of files are waiting on the pool, so memory stays flat however big the source is.
 
-        while q:
-            n = q.pop()
-            temp_dir_output_path = os.path.join(dst, n.abs_to_rpath_helper(original_path, n.base_path))
-            os.mkdir(temp_dir_output_path)
-            q.extend(n.folders)
-            for f in n.files:
-                temp_src = os.path.join(n.base_path, f)
-                temp_dst = os.path.join(temp_dir_output_path, f)
-                shutil.copy(temp_src, temp_dst, follow_symlinks=follow_symlinks)
+        With a journal, every finished file and every folder whose subtree is finished is logged, and files are
+        written to a temp name and renamed into place. finished is the (files, folders) a previous journal recorded;
+        those files are skipped (walk() should have been given the folders as prune).
+
+        dedupe ("hardlink" or "reflink") copies each distinct file content once and links the duplicates to it.
+
+        Pass full_walk=False when src_dirs leaves part of the source out (walk() with max_depth). The manifest then
+        keeps its rows for files that weren't seen instead of forgetting them.
+
+        Counters and phase timings go into stats (see helpers/stats.py). Pass the same Stats to walk() to get the
+        walk and match phases too. The progress line is redrawn from here, as files finish.
+        """
+        resuming = finished is not None
+        finished_files, finished_folders = finished if resuming else (set(), set())
+
+        if os.path.exists(dst) and not (incremental or resuming):
+            self.print_error_with_verbosity(f"Path at {dst} already exists! Please use the --incremental option to sync into an already existing directory, or --resume to continue an interrupted copy!", curr_verbosity)
+            exit(1)
+
+        os.makedirs(dst, exist_ok=True)
+
+        manifest = None
+        has_manifest = False
+        if use_manifest:
+            manifest = Manifest(dst)
+            has_manifest = incremental and manifest.load()
+
+        if journal is not None:
+            journal.open(resume=resuming)
+
+        # Large files are split into ranges on their own pool. It can't share the file pool, since a file worker
+        # waits on its ranges.
+        chunk_pool = ThreadPoolExecutor(max_workers=chunk_workers) if chunk_workers > 1 else None
+        backend = CopyBackend(copy_backend, chunk_size=chunk_size, large_file_threshold=large_file_threshold, chunk_pool=chunk_pool)
+
+        if stats is None:
+            stats = Stats()
+        deduper = Deduper(dedupe) if dedupe else None
+        opts = SyncOptions(follow_symlinks, incremental, checksum, manifest, backend, journal is not None, deduper, stats)
+
+        # Only this thread counts files, so these don't need stats.add() and its lock
+        counts = stats.counters
+
+        # rel folder -> how many of its files and subfolders aren't finished yet. Only used with a journal
+        waiting = {}
+        # Every folder the walk listed, so --delete never removes one that's still in the source. Only kept when
+        # delete_removed() needs it
+        walked = set()
+
+        def finish_folder(rel_path):
+            # A folder finishing may finish its parent too, all the way up
+            while True:
+                journal.folder_done(rel_path)
+                del waiting[rel_path]
+                if not rel_path:
+                    return
+                rel_path = rel_path.rpartition("/")[0]
+                waiting[rel_path] -= 1
+                if waiting[rel_path]:
+                    return
+
+        def record(rel_path, size):
+            if size is None:
+                counts["skipped"] += 1
+            else:
+                counts["files"] += 1
+                counts["bytes"] += size
+            stats.tick()
+
+            if journal is not None:
+                journal.file_done(rel_path)
+                parent = rel_path.rpartition("/")[0]
+                waiting[parent] -= 1
+                if not waiting[parent]:
+                    finish_folder(parent)
+
+        # Directories are always created here, in walk order, so a parent exists before any of its files
+        # are handed to a worker. Only the file copies fan out to the pool.
+        pool = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+        # Cap the number of queued batches so a huge tree doesn't turn into millions of pending futures.
+        max_pending = jobs * 4
+        pending = set()
+        batch = []
+        completed = False
+
+        if pool is not None:
+            src_dirs = prefetch(src_dirs, queue_size)
+
+        try:
+            for d in src_dirs:
+                temp_dir_output_path = os.path.join(dst, d.rel_path)
+                t = time.perf_counter()
+                try:
+                    os.makedirs(temp_dir_output_path, exist_ok=True)
+                except FileExistsError:
+                    # The source has a folder where the last copy had a file
+                    os.remove(temp_dir_output_path)
+                    os.makedirs(temp_dir_output_path)
+                stats.add(phase="mkdir", seconds=time.perf_counter() - t)
+                if delete and (not has_manifest or resuming):
+                    # Workers only ever write names that are in the source, so this can't race with them
+                    counts["deleted"] += self.delete_extraneous(d, temp_dir_output_path)
+                elif delete:
+                    walked.add(d.rel_path)
+                prefix = f"{d.rel_path}/" if d.rel_path else ""
+
+                files = d.files
+                if resuming:
+                    files = [f for f in files if prefix + f not in finished_files]
+                    counts["resumed"] += len(d.files) - len(files)
+
+                if journal is not None:
+                    waiting[d.rel_path] = len(files) + sum(prefix + name not in finished_folders for name in d.folders)
+                    if d.error is not None:
+                        # A folder that couldn't be listed is never done, nor are its parents, so --resume looks
+                        # at it again instead of pruning it
+                        waiting[d.rel_path] += 1
+                    if not waiting[d.rel_path]:
+                        finish_folder(d.rel_path)
+
+                for f in files:
+                    temp_src = os.path.join(d.path, f)
+                    temp_dst = os.path.join(temp_dir_output_path, f)
+                    rel_path = prefix + f
+                    if pool is None:
+                        t = time.perf_counter()
+                        size = self.sync_file(temp_src, temp_dst, rel_path, opts)
+                        stats.add(phase="copy", seconds=time.perf_counter() - t)
+                        record(rel_path, size)
+                        continue
+
+                    batch.append((temp_src, temp_dst, rel_path))
+                    if len(batch) < batch_size:
+                        continue
+
+                    if len(pending) >= max_pending:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            for rel_path, size in future.result():
+                                record(rel_path, size)
+
+                    pending.add(pool.submit(self.sync_batch, batch, opts))
+                    batch = []
+
+            if batch:
+                pending.add(pool.submit(self.sync_batch, batch, opts))
+
+            for future in pending:
+                for rel_path, size in future.result():
+                    record(rel_path, size)
+            completed = True
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
+            if chunk_pool is not None:
+                chunk_pool.shutdown(wait=True, cancel_futures=True)
+            if manifest is not None:
+                # Save what was copied even if the run died, but only forget files once the whole source was seen.
+                # A resumed run never sees the subtrees it skipped, so it can't tell what's gone either.
+                manifest.save(prune=completed and full_walk and not resuming)
+            if journal is not None:
+                journal.close(finished=completed)
+            if not completed:
+                stats.finish()
+
+        if delete and has_manifest and not resuming:
+            counts["deleted"] += self.delete_removed(dst, manifest, walked)
+
+        if deduper is not None:
+            counts["linked"] = deduper.files_linked
+            counts["saved"] = deduper.bytes_saved
+
+        stats.finish()
+        self.print_copy_summary(stats, curr_verbosity)
+        self.print_info_with_verbosity(f"Copy backend: {copy_backend}, files per strategy: {backend.used}", 3, curr_verbosity)
 
 
 class BetterCopy(Helpers):
@@ -177,7 +699,21 @@ class BetterCopy(Helpers):
         self.dst = None
         self.max_depth = None
         self.testing_mode = False
-        self.file_tree = dict()
+        self.jobs = 1
+        self.incremental = False
+        self.checksum = False
+        self.delete = False
+        self.use_manifest = True
+        self.copy_backend = "auto"
+        self.batch_size = 32
+        self.chunk_size = CHUNK_SIZE
+        self.large_file_threshold = LARGE_FILE_THRESHOLD
+        self.chunk_workers = 1
+        self.queue_size = 256
+        self.resume = False
+        self.use_journal = True
+        self.dedupe = None
+        self.stats_json = None
         # Parse the args
         self.init()
 
@@ -192,15 +728,31 @@ class BetterCopy(Helpers):
         group.add_argument("-v", "--verbose", type=int, choices=[0, 1, 2, 3], help="0: Display nothing ... 3: Display everything", default=1)
         group.add_argument("-q", "--quiet", action="store_true")
 
-        parser.add_argument("-g", "--use-gitignore", help="Use the .gitignore file in the src directory instead of .bcignore. (NOT tested!)", action="store_true")
+        parser.add_argument("-g", "--use-gitignore", help="Use the .gitignore file in the src directory instead of .bcignore.", action="store_true")
         parser.add_argument("-l", "--follow-symlinks", help="Follow symlinks when copying files.", action="store_true")
         parser.add_argument("--ignore-file", type=str, help="Ignore file. The default is: .bcignore", default=".bcignore")
         parser.add_argument("--include-file", type=str, help="Source directory The default is: .bcinclude", default=".bcinclude")
-        parser.add_argument("-d", "--max-depth", type=int, help="The max level of folders you want to traverse down")
+        parser.add_argument("-d", "--max-depth", type=int, help="The max level of folders you want to traverse down. 0 only copies the files directly in src. Deeper folders are never opened")
+        parser.add_argument("-j", "--jobs", type=int, help="Number of files to copy in parallel. The default is: 1 (single-threaded)", default=1)
+        parser.add_argument("-i", "--incremental", help="Sync into an existing dst, only copying files that are new or whose size/mtime changed.", action="store_true")
+        parser.add_argument("-c", "--checksum", help="With --incremental, compare file contents (fast hash) instead of mtime when sizes match.", action="store_true")
+        parser.add_argument("--delete", help="With --incremental, delete files in dst that no longer exist in src.", action="store_true")
+        parser.add_argument("--no-manifest", help=f"Don't read or write the {MANIFEST_NAME} manifest in dst. Use this if dst was changed by something other than BetterCopy.", action="store_true")
+        parser.add_argument("--copy-backend", choices=BACKENDS, help="How files are copied. auto picks the fastest one each file supports (reflink, copy_file_range, sendfile, then a buffered loop). The default is: auto", default="auto")
+        parser.add_argument("--batch-size", type=int, help="With --jobs, how many files each worker task copies. The default is: 32", default=32)
+        parser.add_argument("--chunk-size", type=int, help=f"Size in MB of the ranges large files are copied in. The default is: {CHUNK_SIZE // (1024 * 1024)}", default=CHUNK_SIZE // (1024 * 1024))
+        parser.add_argument("--large-file-threshold", type=int, help=f"Files of at least this many MB are preallocated and copied in chunks. The default is: {LARGE_FILE_THRESHOLD // (1024 * 1024)}", default=LARGE_FILE_THRESHOLD // (1024 * 1024))
+        parser.add_argument("--chunk-workers", type=int, help="How many chunks of a large file are copied in parallel. The default is: 1", default=1)
+        parser.add_argument("--queue-size", type=int, help="With --jobs, how many listed directories the walker may get ahead of the copy. The default is: 256", default=256)
+        parser.add_argument("-r", "--resume", help=f"Continue an interrupted copy into dst from its {JOURNAL_NAME} journal.", action="store_true")
+        parser.add_argument("--no-journal", help=f"Don't keep a {JOURNAL_NAME} journal or write files atomically. Faster, but an interrupted copy can't be resumed.", action="store_true")
+        parser.add_argument("--dedupe", help="Copy files with identical content once and link the rest to that copy.", action="store_true")
+        parser.add_argument("--dedupe-link", choices=["hardlink", "reflink"], help="How --dedupe links duplicates. The default is: hardlink", default="hardlink")
+        parser.add_argument("--stats-json", type=str, help="When done, write counters and per-phase timings as JSON to this file, or to stdout if it's -")
         parser.add_argument("-t", "--testing", help="Print out what will happen and don't copy.", action="store_true")
         
         parser.add_argument("src", type=str, help="Source directory")
-        parser.add_argument("dst", type=str, help="Destination directory")
+        parser.add_argument("dst", type=str, help="Destination directory, or an archive to write: .tar, .tar.gz, .tar.bz2, .tar.xz, .tar.zst or .zip")
  
         args = parser.parse_args()
 
@@ -210,14 +762,17 @@ class BetterCopy(Helpers):
             self.verbose = 0
         
         if args.use_gitignore:
-            args.src = os.path.join(args.src, ".gitignore")
+            args.ignore_file = ".gitignore"
 
         self.src = Path(args.src)
         if not self.src.is_dir():
-            self.print_error_with_verbosity(f"The path src \"{self.src}\" is not a directory!")
+            self.print_error_with_verbosity(f"The path src \"{self.src}\" is not a directory!", self.verbose)
             exit(1)
 
         self.dst = Path(args.dst)
+        if self.dst.resolve() == self.src.resolve():
+            self.print_error_with_verbosity("src and dst are the same directory!", self.verbose)
+            exit(1)
         # if not self.dst.is_dir():
         #     self.print_error_with_verbosity(f"The path for dst \"{self.dst}\" is not a directory!", self.verbose)
         #     exit(1)
@@ -232,12 +787,49 @@ class BetterCopy(Helpers):
             self.print_error_with_verbosity(f"The path for --include-file \"{self.include_file}\" is not a file!", self.verbose)
             exit(1)
 
-        if args.max_depth:
+        if args.max_depth is not None:
+            if args.max_depth < 0:
+                self.print_error_with_verbosity(f"-d/--max-depth can't be negative, got {args.max_depth}!", self.verbose)
+                exit(1)
+            if args.delete:
+                # Folders below the limit are never listed, so --delete would take them for removed from src
+                self.print_error_with_verbosity("--delete can't be used with -d/--max-depth!", self.verbose)
+                exit(1)
             self.max_depth = args.max_depth
 
         if args.testing:
             self.testing_mode = True
 
+        if args.jobs < 1:
+            self.print_error_with_verbosity(f"-j/--jobs must be at least 1, got {args.jobs}!", self.verbose)
+            exit(1)
+        self.jobs = args.jobs
+
+        # --checksum and --delete only make sense when syncing into an existing dst
+        self.incremental = args.incremental or args.checksum or args.delete
+        self.checksum = args.checksum
+        self.delete = args.delete
+        self.use_manifest = not args.no_manifest
+        self.copy_backend = args.copy_backend
+
+        for name in ("batch_size", "chunk_size", "large_file_threshold", "chunk_workers", "queue_size"):
+            if getattr(args, name) < 1:
+                self.print_error_with_verbosity(f"--{name.replace('_', '-')} must be at least 1, got {getattr(args, name)}!", self.verbose)
+                exit(1)
+        self.batch_size = args.batch_size
+        self.chunk_size = args.chunk_size * 1024 * 1024
+        self.large_file_threshold = args.large_file_threshold * 1024 * 1024
+        self.chunk_workers = args.chunk_workers
+        self.queue_size = args.queue_size
+
+        if args.resume and args.no_journal:
+            self.print_error_with_verbosity("--resume needs the journal, it can't be used with --no-journal!", self.verbose)
+            exit(1)
+        self.resume = args.resume
+        self.use_journal = not args.no_journal
+        self.dedupe = args.dedupe_link if args.dedupe else None
+        self.stats_json = args.stats_json
+
         self.read_pattern_files()
 
         if len(self.ignore_patterns) == 0 and len(self.include_patterns) == 0:
@@ -253,32 +845,76 @@ class BetterCopy(Helpers):
             self.runner()
 
     def read_pattern_files(self):
-        self.ignore_patterns = self.file_to_list(self.ignore_file)
+        # The raw lines are kept; IgnoreMatcher handles comments, escapes and negations with gitignore rules
+        self.ignore_patterns = read_ignore_file(self.ignore_file)
         # self.include_patterns = self.file_to_list(self.include_file)
         
         self.print_info_with_verbosity(f"{self.ignore_file}: {self.ignore_patterns}", 3, self.verbose)
         # self.print_info_with_verbosity(f"{self.include_file}: {self.include_patterns}", 3, self.verbose)
 
+    def walk_source(self, prune=(), stats=None):
+        # A dst inside src (a folder, or an archive and the temp file it's written to) is never copied into itself
+        exclude = ()
+        if self.dst.resolve().is_relative_to(self.src.resolve()):
+            rel_dst = self.dst.resolve().relative_to(self.src.resolve()).as_posix()
+            exclude = {rel_dst, f"{rel_dst}.bctmp"}
+        return walk(str(self.src.resolve()), IgnoreMatcher(self.ignore_patterns), max_depth=self.max_depth, prune=prune, exclude=exclude, stats=stats,
+                    on_error=lambda msg: self.print_error_with_verbosity(msg, self.verbose))
+
     def testing(self):
         if self.verbose != 3:
             self.print_warning_with_verbosity(f"We recommend setting your verbosity to 3 so you can debug easier. It's currently {self.verbose}", 0, self.verbose)
 
         self.print_info_with_verbosity("Testing mode enabled!", 3, self.verbose)
-        f = FileTree(str(self.src.resolve()), 0, self.include_patterns, self.ignore_patterns)
-        f.pretty_print_file_structure(f.base_path)
+        self.pretty_print_dirs(self.walk_source())
 
     def runner(self):
         self.print_info_with_verbosity(f"src: {self.src.resolve()}\ndst: {self.dst.resolve()}\nIgnore file path: {self.ignore_file.resolve()}\nInclude file path: {self.include_file.resolve()}", 3, self.verbose)
         self.print_info_with_verbosity(f"src: {self.src}\ndst: {self.dst}\nIgnore file path: {self.ignore_file}\nInclude file path: {self.include_file}", 3, self.verbose)
 
-        if not self.max_depth:
-            self.file_tree = self.build_folder_structure(self.src, self.include_patterns, self.ignore_patterns)
-        else:
-            self.file_tree = self.build_folder_structure(self.src, self.include_patterns, self.ignore_patterns, max_depth=self.max_depth)
-
-        f = FileTree(str(self.src.resolve()), 0, self.include_patterns, self.ignore_patterns)
-
-        self.do_deep_copy(f, self.dst.resolve(), self.follow_symlinks)
+        # The progress line goes to stderr and only when it's a terminal, so it never ends up in redirected output
+        stats = Stats(progress=self.verbose > 0)
+        try:
+            self.copy(stats)
+        finally:
+            if self.stats_json:
+                stats.dump_json(self.stats_json)
+
+    def copy(self, stats: Stats):
+        fmt = archive_format(self.dst)
+        if fmt is not None:
+            if self.incremental or self.resume or self.dedupe:
+                self.print_error_with_verbosity("--incremental, --checksum, --delete, --resume and --dedupe only work when dst is a directory, not an archive!", self.verbose)
+                exit(1)
+            if missing_module(fmt):
+                self.print_error_with_verbosity(f"Writing {self.dst.name} needs the {missing_module(fmt)} package: pip install {missing_module(fmt)}", self.verbose)
+                exit(1)
+            self.do_archive(self.walk_source(stats=stats), self.dst.resolve(), fmt, self.follow_symlinks, curr_verbosity=self.verbose, stats=stats)
+            return
+
+        journal = None
+        finished = None
+        if self.use_journal:
+            journal = Journal(self.dst.resolve())
+            if self.resume:
+                finished = journal.load()
+                if finished is None:
+                    self.print_warning_with_verbosity(f"No journal found in {self.dst}, copying everything", 2, self.verbose)
+                    finished = (set(), set())
+
+        # A forced backend that doesn't work here usually fails on the first file. A dst this run created is removed
+        # again instead of being left behind with just the journal and manifest in it.
+        dst_existed = self.dst.exists()
+        try:
+            # Directories are copied as the walker lists them, the tree is never built in memory
+            self.do_deep_copy(self.walk_source(prune=finished[1] if finished else (), stats=stats), self.dst.resolve(), self.follow_symlinks, jobs=self.jobs, curr_verbosity=self.verbose, incremental=self.incremental, checksum=self.checksum, delete=self.delete, use_manifest=self.use_manifest, copy_backend=self.copy_backend, batch_size=self.batch_size,
+                              chunk_size=self.chunk_size, large_file_threshold=self.large_file_threshold, chunk_workers=self.chunk_workers, queue_size=self.queue_size,
+                              journal=journal, finished=finished, dedupe=self.dedupe, full_walk=self.max_depth is None, stats=stats)
+        except UnsupportedBackend as e:
+            if not dst_existed:
+                shutil.rmtree(self.dst, ignore_errors=True)
+            self.print_error_with_verbosity(f"{e.strerror} (--copy-backend {self.copy_backend}). Use --copy-backend auto to fall back to one that works.", self.verbose)
+            exit(1)
 
 if __name__ == "__main__":
     bc = BetterCopy()
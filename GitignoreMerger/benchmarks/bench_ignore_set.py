@@ -0,0 +1,118 @@
+"""
+IgnoreSet against the naive way of checking a path: fnmatch every pattern in turn and keep the last match.
+
+Usage: python benchmarks/bench_ignore_set.py [--patterns 1000] [--paths 200000]
+"""
+import argparse
+import fnmatch
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from merge_gitignore import IgnoreSet, parse_line
+
+
+def make_patterns(n: int, rng: random.Random) -> list[str]:
+    patterns = ["node_modules/", "*.log", "build/", "dist/", "__pycache__/", "*.py[cod]", ".env"]
+    for i in range(len(patterns), n):
+        kind = i % 6
+        if kind == 0:
+            patterns.append(f"literal_{i}")
+        elif kind == 1:
+            patterns.append(f"*.ext{i}")
+        elif kind == 2:
+            patterns.append(f"/top_{i}/")
+        elif kind == 3:
+            patterns.append(f"pkg{i}/**/*.tmp")
+        elif kind == 4:
+            patterns.append(f"file_{i}_?.[ch]")
+        else:
+            patterns.append(f"!keep_{rng.randrange(n)}.log")
+    return patterns
+
+
+def make_paths(n: int, n_patterns: int, rng: random.Random) -> list[str]:
+    paths = []
+    for _ in range(n):
+        depth = rng.randint(1, 6)
+        parts = [rng.choice(["src", "lib", f"pkg{rng.randrange(n_patterns)}", "build", "node_modules", f"d{rng.randrange(50)}"]) for _ in range(depth - 1)]
+        i = rng.randrange(n_patterns)
+        parts.append(rng.choice([f"literal_{i}", f"name.ext{i}", f"file_{i}_a.c", f"plain_{i}.txt", "debug.log", f"keep_{i}.log", "x.tmp"]))
+        paths.append("/".join(parts))
+    # Sorted like a walker or `git ls-files` would hand them over
+    return sorted(paths)
+
+
+def naive_is_ignored(patterns, path) -> bool:
+    # What a script usually does: fnmatch every pattern against every folder above the path and the path itself
+    parts = path.split("/")
+    for depth in range(1, len(parts) + 1):
+        sub = "/".join(parts[:depth])
+        is_dir = depth < len(parts)
+        ignored = False
+        for p in patterns:
+            if p.dir_only and not is_dir:
+                continue
+            if fnmatch.fnmatchcase(sub.rpartition("/")[2] if p.is_name else sub, p.glob.replace("**/", "*")):
+                ignored = not p.negated
+        if ignored:
+            return True
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patterns", type=int, default=1000)
+    parser.add_argument("--paths", type=int, default=200000)
+    parser.add_argument("--naive-paths", type=int, default=2000, help="The naive loop is slow, so it only gets this many paths")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    lines = make_patterns(args.patterns, rng)
+    paths = make_paths(args.paths, args.patterns, rng)
+
+    start = time.perf_counter()
+    ignore_set = IgnoreSet.from_lines(lines)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        artifact = os.path.join(tmp, "ignore.json")
+        ignore_set.save(artifact)
+        # Otherwise load() gets the regexes build() just compiled from re's cache
+        re.purge()
+        start = time.perf_counter()
+        loaded = IgnoreSet.load(artifact)
+        load_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    kept = loaded.filter(paths)
+    filter_ns = (time.perf_counter() - start) / len(paths) * 1e9
+
+    start = time.perf_counter()
+    for path in paths:
+        loaded.decides(path)
+    decides_ns = (time.perf_counter() - start) / len(paths) * 1e9
+
+    naive = [p for p in map(parse_line, lines) if p is not None]
+    sample = paths[::max(1, len(paths) // args.naive_paths)]
+    start = time.perf_counter()
+    naive_kept = [path for path in sample if not naive_is_ignored(naive, path)]
+    naive_ns = (time.perf_counter() - start) / len(sample) * 1e9
+
+    print(f"patterns: {len(lines)}, paths: {len(paths)}, kept: {len(kept)}")
+    print(f"build: {build_ms:.1f} ms, load from artifact: {load_ms:.1f} ms")
+    print(f"fnmatch loop:          {naive_ns:12,.0f} ns/path")
+    print(f"IgnoreSet.decides:     {decides_ns:12,.0f} ns/path (no parent folders)")
+    print(f"IgnoreSet.filter:      {filter_ns:12,.0f} ns/path ({naive_ns / filter_ns:.0f}x)")
+    if naive_kept != loaded.filter(sample):
+        print("Warning: the fnmatch loop and IgnoreSet disagree on some paths (fnmatch's * also matches /)")
+
+
+if __name__ == "__main__":
+    main()
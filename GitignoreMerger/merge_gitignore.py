@@ -1,57 +1,1015 @@
+import argparse
+import bisect
+import functools
+import itertools
+import json
 import os
+import re
 import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+GLOB_CHARS = set("*?[\\")
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+class Pattern:
+    """
+    One .gitignore line, normalized so lines that mean the same thing compare equal.
+
+    glob has no leading or trailing "/", anchored says whether it only matches relative to the root (a "/" at the
+    start or in the middle), dir_only whether it had a trailing "/". "**/foo" and "/**/foo" become plain "foo",
+    runs of "**/" collapse into one and unescaped trailing spaces are dropped, so "foo", "foo  " and "**/foo" all
+    share one key. "/foo" and "foo/" keep their own keys since git treats them differently.
+
+    source and line_no say where the line came from, for the report.
+    """
+    __slots__ = ("glob", "negated", "dir_only", "anchored", "source", "line_no", "regex")
+
+    def __init__(self, glob: str, negated=False, dir_only=False, anchored=False, source=None, line_no=0) -> None:
+        self.glob = glob
+        self.negated = negated
+        self.dir_only = dir_only
+        self.anchored = anchored
+        self.source = source
+        self.line_no = line_no
+        self.regex = None
+
+    def __repr__(self) -> str:
+        return f"Pattern({self.text()!r}, source={self.source!r}, line_no={self.line_no})"
+
+    @property
+    def key(self) -> tuple:
+        return self.negated, self.dir_only, self.anchored, self.glob
+
+    @property
+    def is_literal(self) -> bool:
+        return not any(c in GLOB_CHARS for c in self.glob)
+
+    @property
+    def is_name(self) -> bool:
+        # Matches an entry by its name at any depth, like "*.pyc" or "node_modules"
+        return not self.anchored and "/" not in self.glob
+
+    def where(self) -> str:
+        return f"{self.source}:{self.line_no}" if self.source else f"line {self.line_no}"
+
+    def text(self) -> str:
+        """
+        The canonical .gitignore line for this pattern.
+        """
+        glob = self.glob
+        if glob[:1] in ("!", "#"):
+            glob = "\\" + glob
+        if self.anchored and "/" not in glob:
+            glob = "/" + glob
+        return f"{'!' if self.negated else ''}{glob}{'/' if self.dir_only else ''}"
+
+    def matches(self, path: str, is_dir=False) -> bool:
+        """
+        Whether this pattern matches one "/" separated path relative to the root. Parent folders aren't looked at.
+        """
+        if self.dir_only and not is_dir:
+            return False
+        if self.regex is None:
+            self.regex = re.compile(glob_to_regex(self.glob), re.DOTALL)
+        if self.is_name:
+            path = path.rpartition("/")[2]
+        return self.regex.fullmatch(path) is not None
+
+
+def normalize_glob(glob: str) -> tuple[str, bool]:
+    """
+    Returns (glob, anchored) for a line that already had its "!" and trailing "/" removed.
+    """
+    anchored = "/" in glob
+    glob = glob.lstrip("/")
+
+    while "**/**/" in glob:
+        glob = glob.replace("**/**/", "**/")
+    if glob.endswith("/**/**"):
+        glob = glob[:-3]
+
+    # A leading "**/" in front of a single name is the same as no slash at all
+    rest = glob
+    while rest.startswith("**/"):
+        rest = rest[3:]
+    if rest != glob and rest and "/" not in rest:
+        return rest, False
+
+    return glob, anchored
+
+
+def parse_line(line: str, source=None, line_no=0) -> Pattern | None:
+    """
+    Parse one .gitignore line. Returns None for blank lines and comments.
+    """
+    line = line.rstrip("\r\n")
+
+    # Trailing spaces are ignored unless they're escaped with a backslash
+    while line.endswith(" ") and not line.endswith("\\ "):
+        line = line[:-1]
+
+    if not line or line.startswith("#"):
+        return None
+
+    negated = False
+    if line.startswith("!"):
+        negated = True
+        line = line[1:]
+    elif line.startswith("\\!") or line.startswith("\\#"):
+        line = line[1:]
+
+    dir_only = False
+    if line.endswith("/"):
+        dir_only = True
+        line = line.rstrip("/")
+
+    glob, anchored = normalize_glob(line)
+    if not glob:
+        return None
+
+    return Pattern(glob, negated, dir_only, anchored, source, line_no)
+
+
+def glob_to_regex(pattern: str) -> str:
+    """
+    Translate a gitignore glob into a regex body that matches a whole "/" separated relative path.
+    """
+    out = []
+    i = 0
+    n = len(pattern)
+
+    while i < n:
+        c = pattern[i]
+
+        if c == "*":
+            if pattern.startswith("**", i):
+                at_start = i == 0 or pattern[i - 1] == "/"
+                at_end = i + 2 == n
+                followed_by_slash = i + 2 < n and pattern[i + 2] == "/"
+
+                if at_start and followed_by_slash:
+                    # "**/" matches zero or more directories
+                    out.append("(?:.*/)?")
+                    i += 3
+                    continue
+                if at_start and at_end:
+                    # "/**" matches everything inside
+                    out.append(".*")
+                    i += 2
+                    continue
+
+                # Any other run of asterisks is just a regular "*"
+                while i < n and pattern[i] == "*":
+                    i += 1
+                out.append("[^/]*")
+                continue
+
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            j = i + 1
+            if j < n and pattern[j] in "!^":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+
+            if j >= n:
+                # No closing bracket, so it's a literal "["
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j]
+                if body[:1] in ("!", "^"):
+                    body = "^" + body[1:]
+                out.append(f"(?!/)[{body.replace(chr(92), chr(92) * 2)}]")
+                i = j
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+
+        i += 1
+
+    return "".join(out)
+
+
+def dedupe(patterns: list[Pattern]) -> list[Pattern]:
+    """
+    Keep one copy of every semantically distinct pattern without changing what the list ignores.
+
+    In gitignore the last matching line wins, so dropping an earlier copy of a line is always safe, but dropping a
+    later one isn't if a line of the opposite sign sits between the two ("foo", "!foo", "foo"). So each pattern keeps
+    its earliest copy that has no line of the opposite sign between it and the last copy. Usually that's just the
+    first copy, which keeps the output in the order people wrote it.
+    """
+    # opposite[negated][i] = how many lines of the other sign come before index i
+    opposite = {True: [0], False: [0]}
+    occurrences = {}
+    for i, p in enumerate(patterns):
+        opposite[True].append(opposite[True][-1] + (not p.negated))
+        opposite[False].append(opposite[False][-1] + p.negated)
+        occurrences.setdefault(p.key, []).append(i)
+
+    keep = []
+    for indexes in occurrences.values():
+        counts = opposite[patterns[indexes[0]].negated]
+        last = indexes[-1]
+        keep.append(next(i for i in indexes if counts[last] == counts[i + 1]))
+
+    return [patterns[i] for i in sorted(keep)]
+
+
+def read_patterns(filepath: str, source=None) -> list[Pattern]:
+    with open(filepath, "r", encoding="utf-8") as f:
+        return [p for line_no, line in enumerate(f, 1) if (p := parse_line(line, source, line_no)) is not None]
+
+
+def read_ahead(fn, items, workers=8):
+    """
+    Yield fn(item) for every item, in order, while up to 2 * workers of the next calls already run on a thread pool.
+    Reading hundreds of small files is mostly waiting on the disk, so this overlaps the waits without ever holding
+    more than a window of results in memory.
+    """
+    if workers <= 1:
+        yield from map(fn, items)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class SeenPatterns:
+    """
+    The patterns of one sign stream_merge() has written, by the hash of their key, indexed by the last part of their
+    glob so the ones a new line of the other sign might overlap with are found without checking every one of them.
+    """
+    def __init__(self) -> None:
+        # hash -> the last part of its glob
+        self.keys = {}
+        # literal last part -> hashes
+        self.names = {}
+        # suffix of a "*suffix" last part -> hashes
+        self.suffixes = {}
+        # hash -> last part, for every other glob
+        self.globs = {}
+
+    def __contains__(self, h: int) -> bool:
+        return h in self.keys
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, h: int, name: str) -> None:
+        self.keys[h] = name
+        if not any(c in GLOB_CHARS for c in name):
+            self.names.setdefault(name, set()).add(h)
+        elif name.startswith("*") and len(name) > 1 and not any(c in GLOB_CHARS for c in name[1:]):
+            self.suffixes.setdefault(name[1:], set()).add(h)
+        else:
+            self.globs[h] = name
+
+    def forget_overlapping(self, name: str) -> None:
+        """
+        Forget every pattern whose last part might match the same names as `name`.
+        """
+        if not any(c in GLOB_CHARS for c in name):
+            found = set(self.names.get(name, ()))
+            for suffix, hashes in self.suffixes.items():
+                if name.endswith(suffix):
+                    found.update(hashes)
+        else:
+            # A glob against literals is checked one by one, anything against another glob is assumed to overlap
+            found = {h for hashes in self.suffixes.values() for h in hashes}
+            found.update(h for literal, hashes in self.names.items() if names_may_overlap(literal, name) for h in hashes)
+        found.update(h for h, glob in self.globs.items() if names_may_overlap(glob, name))
+
+        for h in found:
+            last = self.keys.pop(h)
+            self.globs.pop(h, None)
+            for table, k in ((self.names, last), (self.suffixes, last[1:])):
+                hashes = table.get(k)
+                if hashes is not None and h in hashes:
+                    hashes.discard(h)
+                    if not hashes:
+                        del table[k]
+
+
+def stream_merge(pattern_lists, out) -> tuple[int, int]:
+    """
+    Write each list of patterns from pattern_lists to out as soon as it arrives, dropping duplicates on the way.
+    Returns (patterns read, patterns written).
+
+    Patterns are remembered by the hash of their key (plus the last part of their glob), one table per sign, so
+    memory grows with the number of distinct patterns and not with the size of the input, and no Pattern outlives
+    its file. A copy can only be dropped if no line of the opposite sign that might match the same paths was written
+    since the first copy (see dedupe()), so writing a line forgets the patterns of the other sign it overlaps with.
+    With interleaved negations ("*.log", "!keep.log", "*.log", ...) that writes a few more duplicates than dedupe()
+    would, but never changes what's ignored.
+    """
+    seen = {False: SeenPatterns(), True: SeenPatterns()}
+    read = 0
+    written = 0
+
+    for patterns in pattern_lists:
+        read += len(patterns)
+        lines = []
+        for p in patterns:
+            h = hash(p.key)
+            if h in seen[p.negated]:
+                continue
+            name = p.glob.rpartition("/")[2]
+            seen[p.negated].add(h, name)
+            if seen[not p.negated]:
+                seen[not p.negated].forget_overlapping(name)
+            lines.append(p.text())
+
+        if lines:
+            if written:
+                out.write("\n")
+            out.write(f"# {patterns[0].source}\n")
+            out.write("\n".join(lines) + "\n")
+            written += len(lines)
+
+    return read, written
+
+
+class Finding:
+    """
+    Something the merge noticed about a pattern:
+        redundant    a later pattern of the same sign already matches everything it does
+        shadowed     a later pattern of the opposite sign matches everything it does, so it never has an effect.
+                     Usually two of the merged files disagree
+        ineffective  a "!" pattern for something inside a folder that's ignored. Git never looks inside ignored
+                     folders, so it can't re-include anything
+        inside       a pattern for something inside a folder that's already ignored
+    by is the pattern responsible.
+    """
+    __slots__ = ("kind", "pattern", "by")
+
+    def __init__(self, kind: str, pattern: Pattern, by: Pattern) -> None:
+        self.kind = kind
+        self.pattern = pattern
+        self.by = by
+
+    def __str__(self) -> str:
+        p = f"{self.pattern.text()} ({self.pattern.where()})"
+        by = f"{self.by.text()} ({self.by.where()})"
+        if self.kind == "redundant":
+            return f"redundant: {p} is covered by {by}"
+        if self.kind == "shadowed":
+            return f"conflict: {p} is always overridden by {by}"
+        if self.kind == "ineffective":
+            return f"conflict: {p} can't re-include anything, its folder is ignored by {by}"
+        return f"redundant: {p} is inside a folder already ignored by {by}"
+
+
+class PatternIndex:
+    """
+    Finds every pattern in a list that matches a concrete path without running all of them: literal names and
+    "*suffix" names are dict lookups, only the rest are tried one by one.
+    """
+    def __init__(self, patterns: list[Pattern]) -> None:
+        self.patterns = patterns
+        self.names = {}
+        self.suffixes = {}
+        self.name_globs = {}
+        self.others = []
+
+        for i, p in enumerate(patterns):
+            if p.is_name and p.is_literal:
+                self.names.setdefault(p.glob, []).append(i)
+            elif p.is_name and p.glob.startswith("*") and len(p.glob) > 1 and not any(c in GLOB_CHARS for c in p.glob[1:]):
+                self.suffixes.setdefault(p.glob[1:], []).append(i)
+            else:
+                self.others.append(i)
+            if p.is_name:
+                self.name_globs.setdefault(p.glob, []).append(i)
+
+        self.suffix_lengths = sorted({len(s) for s in self.suffixes})
+
+    def matching(self, path: str, is_dir=False) -> list[int]:
+        """
+        Indexes of the patterns that match path, in order.
+        """
+        name = path.rpartition("/")[2]
+        found = list(self.names.get(name, ()))
+        for length in self.suffix_lengths:
+            if length > len(name):
+                break
+            found.extend(self.suffixes.get(name[-length:], ()))
+        found.extend(i for i in self.others if self.patterns[i].matches(path, is_dir))
+        return sorted(i for i in found if is_dir or not self.patterns[i].dir_only)
+
+    def decides(self, path: str, is_dir=False) -> Pattern | None:
+        """
+        The pattern that decides whether path itself is ignored (the last one matching it), if any.
+        """
+        found = self.matching(path, is_dir)
+        return self.patterns[found[-1]] if found else None
+
+    def covering(self, i: int) -> list[int]:
+        """
+        Indexes of the other patterns that match every path pattern i matches, as far as that can be told from
+        their shapes: a name pattern covers a literal path whose name it matches, or a glob whose last part is the
+        same glob, and any pattern covers a literal path it matches.
+        """
+        p = self.patterns[i]
+
+        if p.is_literal:
+            # A pattern that isn't dir-only also matches files, so whatever covers it has to as well
+            found = self.matching(p.glob, is_dir=p.dir_only)
+            if not p.anchored:
+                found = [j for j in found if self.patterns[j].is_name]
+        else:
+            last = p.glob.rpartition("/")[2]
+            if "**" in last:
+                return []
+            found = [j for j in self.name_globs.get(last, []) + self.name_globs.get("*", []) if p.dir_only or not self.patterns[j].dir_only]
+
+        return sorted(j for j in set(found) if j != i)
+
+
+@functools.lru_cache(maxsize=4096)
+def name_regex(glob: str) -> re.Pattern:
+    return re.compile(glob_to_regex(glob), re.DOTALL)
+
+
+def names_may_overlap(a: str, b: str) -> bool:
+    """
+    Whether two last parts of globs might match the same name. Errs on the side of yes: it's only no when one of
+    them is literal and the other can't match it.
+    """
+    if "**" in a or "**" in b:
+        return True
+    if not any(c in GLOB_CHARS for c in a):
+        return name_regex(b).fullmatch(a) is not None
+    if not any(c in GLOB_CHARS for c in b):
+        return name_regex(a).fullmatch(b) is not None
+    return True
+
+
+def may_overlap(a: Pattern, b: Pattern) -> bool:
+    """
+    Whether a and b might match the same path, judged by the last part of their globs.
+    """
+    return names_may_overlap(a.glob.rpartition("/")[2], b.glob.rpartition("/")[2])
+
+
+def find_redundant(patterns: list[Pattern]) -> list[Finding]:
+    """
+    Look for patterns that can't change the result of the list. The list itself is left alone. A pattern is
+    redundant or shadowed if a later one covers it (the last one decides), or if an earlier one of the same sign
+    covers it and nothing of the opposite sign in between could match the same paths ("*.pyc", then "sub/*.pyc").
+    It's inside/ineffective if a folder above it is ignored.
+    """
+    index = PatternIndex(patterns)
+    negated = [i for i, p in enumerate(patterns) if p.negated]
+    not_negated = [i for i, p in enumerate(patterns) if not p.negated]
+    findings = []
+
+    for i, p in enumerate(patterns):
+        covering = index.covering(i)
+        if covering and covering[-1] > i:
+            by = patterns[covering[-1]]
+            findings.append(Finding("redundant" if by.negated == p.negated else "shadowed", p, by))
+            continue
+
+        earlier = [j for j in covering if patterns[j].negated == p.negated]
+        if earlier:
+            j = earlier[-1]
+            opposite = not_negated if p.negated else negated
+            between = opposite[bisect.bisect_right(opposite, j):bisect.bisect_left(opposite, i)]
+            if not any(may_overlap(patterns[k], p) for k in between):
+                findings.append(Finding("redundant", p, patterns[j]))
+                continue
+
+        if not p.anchored:
+            continue
+
+        # Folders above the pattern, as far as they're spelled out literally
+        parts = p.glob.split("/")[:-1]
+        parent = ""
+        for part in parts:
+            if any(c in GLOB_CHARS for c in part):
+                break
+            parent = f"{parent}/{part}" if parent else part
+            by = index.decides(parent, is_dir=True)
+            if by is not None and not by.negated:
+                findings.append(Finding("ineffective" if p.negated else "inside", p, by))
+                break
+
+    return findings
+
+
+def escape_glob(path: str) -> str:
+    # Folder names are literal, so anything git would read as a wildcard gets a backslash
+    return "".join(f"\\{c}" if c in GLOB_CHARS else c for c in path)
+
+
+def rebase(p: Pattern, base: str) -> Pattern:
+    """
+    Rewrite a pattern from the ignore file in folder base (relative to the root, "/" separated) so it means the same
+    thing in an ignore file at the root: "*.log" in sub/.gitignore becomes "sub/**/*.log" and "/build" becomes
+    "sub/build".
+    """
+    if not base:
+        return p
+    base = escape_glob(base)
+    glob = f"{base}/**/{p.glob}" if p.is_name else f"{base}/{p.glob}"
+    return Pattern(glob, p.negated, p.dir_only, True, p.source, p.line_no)
+
+
+def is_dir_ignored(chain, rel_path: str) -> bool:
+    """
+    Whether a folder is ignored according to the ignore files above it. chain is (folder, PatternIndex) for each of
+    them, root first. Like git, the deepest ignore file with a pattern that matches wins.
+    """
+    for base, index in reversed(chain):
+        p = index.decides(rel_path[len(base) + 1:] if base else rel_path, is_dir=True)
+        if p is not None:
+            return not p.negated
+    return False
+
+
+def discover(root: str, name=".gitignore"):
+    """
+    Yield the patterns of root/name and of every nested file called name, rebased onto root (see rebase()). Parents
+    come before their subfolders, which is also the order git gives them precedence in: a deeper file overrides the
+    ones above it. Sibling folders come in name order.
+
+    One os.scandir() pass per folder with an explicit stack. Folders the ignore files above them already ignore are
+    never opened, since git doesn't read ignore files in there either, which also keeps the walk out of
+    node_modules and build output. .git is always skipped.
+    """
+    stack = [(root, "", ())]
+    while stack:
+        path, rel_path, chain = stack.pop()
+
+        ignore_path = os.path.join(path, name)
+        if os.path.isfile(ignore_path):
+            source = f"{rel_path}/{name}" if rel_path else name
+            patterns = read_patterns(ignore_path, source)
+            chain = chain + ((rel_path, PatternIndex(patterns)),)
+            yield [rebase(p, rel_path) for p in patterns]
+
+        prefix = f"{rel_path}/" if rel_path else ""
+        try:
+            with os.scandir(path) as it:
+                folders = sorted(entry.name for entry in it if entry.is_dir(follow_symlinks=False) and entry.name != ".git")
+        except OSError as e:
+            print(f"Unable to read {path}: {e}", file=sys.stderr)
+            continue
+
+        for folder in reversed(folders):
+            if not is_dir_ignored(chain, prefix + folder):
+                stack.append((os.path.join(path, folder), prefix + folder, chain))
+
+
+def merge_files(files=(), root=None, jobs=8) -> list[Pattern]:
+    """
+    Read and merge the given ignore files, followed by every .gitignore under root if it's given (see discover()),
+    the same way the command line does. Returns the merged patterns in order.
+    """
+    sources = read_ahead(lambda path: read_patterns(path, path), list(files), jobs)
+    if root is not None:
+        sources = itertools.chain(sources, discover(root))
+    return dedupe([p for patterns in sources for p in patterns])
+
+
+class IgnoreSet:
+    """
+    A merged pattern list compiled for answering "is this path ignored?" many times over.
+
+    Patterns are sorted into buckets by shape: literal names ("node_modules") and literal paths ("sub/build") are
+    dict lookups, "*suffix" names ("*.pyc") are dict lookups on the end of the name, and every other glob goes into
+    a combined regex per (name or path, dir-only or not, literal prefix) group. Splitting by the literal prefix
+    ("pkg1/" in "pkg1/**/*.tmp") means only the few regexes whose prefix the path starts with are ever run. Inside a
+    regex the alternatives are ordered by descending position, so the group that matched is the last matching
+    pattern, which is the one git would use.
+
+    save() writes the buckets and regex sources as JSON, so another tool can load() them without parsing, merging or
+    sorting anything again.
+    """
+    VERSION = 1
+    DIR_CACHE_SIZE = 100_000
+
+    def __init__(self, patterns: list[Pattern], tables=None) -> None:
+        self.patterns = patterns
+        self.dir_cache = {}
+
+        if tables is None:
+            tables = self.build_tables(patterns)
+        self.names = tables["names"]
+        self.paths = tables["paths"]
+        self.suffixes = tables["suffixes"]
+        self.suffix_lengths = sorted({len(suffix) for suffix in self.suffixes}, reverse=True)
+
+        # (name or path, dir-only) -> (prefix lengths, prefix -> regex)
+        groups = {}
+        for on_name, dir_only, prefix, source in tables["regexes"]:
+            groups.setdefault((on_name, dir_only), {})[prefix] = re.compile(source, re.DOTALL)
+        self.regexes = [(on_name, dir_only, sorted({len(prefix) for prefix in by_prefix}), by_prefix) for (on_name, dir_only), by_prefix in groups.items()]
+
+    @classmethod
+    def from_lines(cls, lines) -> "IgnoreSet":
+        return cls(dedupe([p for p in (parse_line(line) for line in lines) if p is not None]))
+
+    @classmethod
+    def from_files(cls, files=(), root=None) -> "IgnoreSet":
+        return cls(merge_files(files, root))
+
+    @staticmethod
+    def build_tables(patterns: list[Pattern]) -> dict:
+        names = {}
+        paths = {}
+        suffixes = {}
+        groups = {}
+
+        # Highest index first, so the first usable candidate in a bucket is the one that decides
+        for i in range(len(patterns) - 1, -1, -1):
+            p = patterns[i]
+            if p.is_literal:
+                (names if p.is_name else paths).setdefault(p.glob, []).append(i)
+            elif p.is_name and p.glob.startswith("*") and len(p.glob) > 1 and not any(c in GLOB_CHARS for c in p.glob[1:]):
+                suffixes.setdefault(p.glob[1:], []).append(i)
+            else:
+                prefix = p.glob[:next(j for j, c in enumerate(p.glob) if c in GLOB_CHARS)]
+                groups.setdefault((p.is_name, p.dir_only, prefix), []).append(f"(?P<p{i}>{glob_to_regex(p.glob)})")
+
+        regexes = [(on_name, dir_only, prefix, "|".join(parts)) for (on_name, dir_only, prefix), parts in groups.items()]
+        return {"names": names, "paths": paths, "suffixes": suffixes, "regexes": regexes}
+
+    def pick(self, candidates, is_dir, best) -> int:
+        if candidates:
+            for i in candidates:
+                if is_dir or not self.patterns[i].dir_only:
+                    return max(i, best)
+        return best
+
+    def decides(self, path: str, is_dir=False) -> Pattern | None:
+        """
+        The last pattern matching path itself, or None. Folders above path aren't looked at, see is_ignored().
+        """
+        name = path.rpartition("/")[2]
+        best = -1
+        best = self.pick(self.names.get(name), is_dir, best)
+        best = self.pick(self.paths.get(path), is_dir, best)
+        for length in self.suffix_lengths:
+            if length <= len(name):
+                best = self.pick(self.suffixes.get(name[-length:]), is_dir, best)
+
+        for on_name, dir_only, lengths, by_prefix in self.regexes:
+            if dir_only and not is_dir:
+                continue
+            target = name if on_name else path
+            for length in lengths:
+                if length > len(target):
+                    break
+                regex = by_prefix.get(target[:length])
+                if regex is not None:
+                    m = regex.fullmatch(target)
+                    if m is not None:
+                        best = max(best, int(m.lastgroup[1:]))
+
+        return self.patterns[best] if best >= 0 else None
+
+    def dir_ignored(self, path: str) -> bool:
+        ignored = self.dir_cache.get(path)
+        if ignored is None:
+            p = self.decides(path, is_dir=True)
+            ignored = p is not None and not p.negated
+            if len(self.dir_cache) >= self.DIR_CACHE_SIZE:
+                self.dir_cache.clear()
+            self.dir_cache[path] = ignored
+        return ignored
+
+    def is_ignored(self, path: str, is_dir=False) -> bool:
+        """
+        Whether git would ignore path ("/" separated, relative to the root). A trailing "/" means it's a folder.
+        Anything inside an ignored folder is ignored too, and folder answers are cached, so checking a sorted list
+        of paths mostly costs one lookup per path.
+        """
+        if path.endswith("/"):
+            is_dir = True
+            path = path.rstrip("/")
+        path = path.lstrip("/")
+
+        end = path.find("/")
+        while end != -1:
+            if self.dir_ignored(path[:end]):
+                return True
+            end = path.find("/", end + 1)
+
+        if is_dir:
+            return self.dir_ignored(path)
+        p = self.decides(path)
+        return p is not None and not p.negated
+
+    def filter(self, paths) -> list[str]:
+        """
+        The paths that aren't ignored, in order.
+        """
+        is_ignored = self.is_ignored
+        return [path for path in paths if not is_ignored(path)]
+
+    def save(self, filepath) -> None:
+        tables = self.build_tables(self.patterns)
+        data = {"version": self.VERSION, "patterns": [p.text() for p in self.patterns], **tables}
+        with open(filepath, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, filepath) -> "IgnoreSet":
+        with open(filepath, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != cls.VERSION:
+            raise ValueError(f"{filepath} was written by a different version of merge_gitignore.py, compile it again")
+        return cls([parse_line(line) for line in data["patterns"]], data)
+
+
+def example(glob: str) -> str:
+    """
+    A path the glob matches: "*" becomes "x", "?" becomes "q", a bracket becomes its first character and "**"
+    becomes one folder.
+    """
+    out = []
+    i = 0
+    n = len(glob)
+    while i < n:
+        c = glob[i]
+        if glob.startswith("**", i):
+            out.append("d")
+            i += 2
+            continue
+        if c == "*":
+            out.append("x")
+        elif c == "?":
+            out.append("q")
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(glob[i])
+        elif c == "[" and "]" in glob[i + 2:]:
+            j = glob.index("]", i + 2)
+            body = glob[i + 1:j]
+            if body[:1] in ("!", "^"):
+                out.append(next(ch for ch in "z0_~" if ch not in body))
+            else:
+                out.append(body[0])
+            i = j
+        else:
+            out.append(c)
+        i += 1
+    return "".join(out)
+
+
+def sample_paths(patterns: list[Pattern], corpus=()) -> list[str]:
+    """
+    Paths to check two pattern lists against: an example of every pattern, the same at a deeper level and with
+    something inside it, plus whatever's in corpus (the output of `git ls-files` or `find` makes a good one).
+    """
+    paths = set(corpus)
+    for p in patterns:
+        ex = example(p.glob)
+        paths.update((ex, f"{ex}/child", f"nested/{ex}", f"nested/{ex}/child"))
+    return sorted(paths)
+
+
+def first_difference(a: list[Pattern], b: list[Pattern], paths) -> tuple[str, bool] | None:
+    """
+    The first (path, is_dir) that a and b disagree on, or None if they ignore exactly the same paths.
+    """
+    a = IgnoreSet(a)
+    b = IgnoreSet(b)
+    for path in paths:
+        for is_dir in (False, True):
+            if a.is_ignored(path, is_dir) != b.is_ignored(path, is_dir):
+                return path, is_dir
+    return None
+
+
+def char_class(chars) -> str:
+    """
+    A bracket expression for chars, with runs of 3 or more consecutive letters or digits written as a range.
+    """
+    chars = sorted(set(chars))
+    out = []
+    i = 0
+    while i < len(chars):
+        j = i
+        while j + 1 < len(chars) and ord(chars[j + 1]) == ord(chars[j]) + 1 and chars[j + 1].isalnum() and chars[i].isalnum() and chars[j + 1].isdigit() == chars[i].isdigit():
+            j += 1
+        out.append(f"{chars[i]}-{chars[j]}" if j - i >= 2 else "".join(chars[i:j + 1]))
+        i = j + 1
+    return f"[{''.join(out)}]"
+
+
+def collapse_literals(patterns: list[Pattern]) -> tuple[list[Pattern], int]:
+    """
+    Merge literal patterns that only differ in one character of their name into one bracket glob: "cache1/",
+    "cache2/" and "cache3/" become "cache[1-3]/". Only letters, digits, "." and "_" are put in brackets, and only
+    patterns of the same kind (sign, dir-only, anchoring, folder part) are merged. The merged pattern takes the place
+    of the last one, which is only done if no line of the opposite sign between them could match the same paths.
+
+    Returns the new list and how many patterns went into merged globs.
+    """
+    opposite_indexes = {True: [i for i, p in enumerate(patterns) if not p.negated], False: [i for i, p in enumerate(patterns) if p.negated]}
+
+    groups = {}
+    for i, p in enumerate(patterns):
+        if not p.is_literal:
+            continue
+        folder, _, name = p.glob.rpartition("/")
+        for k, c in enumerate(name):
+            if c.isalnum() or c in "._":
+                groups.setdefault((p.negated, p.dir_only, p.anchored, folder, name[:k], name[k + 1:]), []).append(i)
+
+    merged_into = {}
+    replacements = {}
+    # Biggest groups first, every pattern goes into one glob at most
+    for key, members in sorted(groups.items(), key=lambda item: -len(item[1])):
+        members = [i for i in members if i not in merged_into]
+        if len(members) < 2:
+            continue
+
+        negated, dir_only, anchored, folder, before, after = key
+        last = members[-1]
+        opposite = opposite_indexes[negated]
+        between = opposite[bisect.bisect_right(opposite, members[0]):bisect.bisect_left(opposite, last)]
+        if any(may_overlap(patterns[j], patterns[i]) for i in members for j in between if j > i):
+            continue
+
+        chars = [patterns[i].glob.rpartition("/")[2][len(before)] for i in members]
+        glob = f"{before}{char_class(chars)}{after}"
+        if folder:
+            glob = f"{folder}/{glob}"
+        source = patterns[last]
+        replacements[last] = Pattern(glob, negated, dir_only, anchored, source.source, source.line_no)
+        for i in members:
+            merged_into[i] = last
+
+    out = []
+    for i, p in enumerate(patterns):
+        if i in replacements:
+            out.append(replacements[i])
+        elif i not in merged_into:
+            out.append(p)
+    return out, len(merged_into)
+
+
+def minimize(patterns: list[Pattern], corpus=()) -> tuple[list[Pattern], list[Finding], int, int]:
+    """
+    Shrink a merged list without changing what it ignores: drop every pattern find_redundant() reports, then
+    collapse sibling literals with collapse_literals().
+
+    Each step is checked against sample_paths() and only kept if the result ignores exactly the same paths as the
+    input. If dropping everything at once doesn't pass, patterns are dropped one at a time, keeping only the drops
+    that pass.
+
+    Returns (the minimized list, the findings for the patterns that were dropped, how many literals were collapsed,
+    how many sample paths were checked).
+    """
+    paths = sample_paths(patterns, corpus)
+
+    findings = find_redundant(patterns)
+    dropped = {id(f.pattern) for f in findings}
+    result = [p for p in patterns if id(p) not in dropped]
+
+    if first_difference(patterns, result, paths) is not None:
+        result = list(patterns)
+        kept_findings = []
+        for f in findings:
+            trial = [p for p in result if p is not f.pattern]
+            if first_difference(patterns, trial, paths) is None:
+                result = trial
+                kept_findings.append(f)
+        findings = kept_findings
+
+    collapsed, n_collapsed = collapse_literals(result)
+    if n_collapsed:
+        paths = sample_paths(patterns + collapsed, corpus)
+        if first_difference(patterns, collapsed, paths) is None:
+            result = collapsed
+        else:
+            n_collapsed = 0
+
+    return result, findings, n_collapsed, len(paths)
 
 
 class Merger:
     def __init__(self) -> None:
         self.current_directory = os.getcwd()
+        args = self.parse_args(sys.argv[1:])
         # Added "_merged" just in case you're merging a file in the same directory called ".gitignore"
-        self.output_filename = os.path.join(self.current_directory, ".gitignore_merged")
-        self.input_files = self.input_files_abs_path(sys.argv[1:])
+        self.output_filename = os.path.join(self.current_directory, args.output)
+        self.input_files = self.input_files_abs_path(args.files)
+        self.root = args.recursive
+        self.compiled_filename = args.compile and os.path.join(self.current_directory, args.compile)
+        self.minimize = args.minimize
+        self.corpus = args.corpus
+        self.files_read = 0
+        self.quiet = args.quiet
+        self.stream = args.stream
+        self.jobs = args.jobs
         self.all_lines = []
-        self.already_seen = set()
-        self.ignore_line = {"#"}
+        self.patterns = []
+        self.findings = []
         self.driver()
 
+    def parse_args(self, argv):
+        parser = argparse.ArgumentParser(description="Merge several .gitignore files into one.", fromfile_prefix_chars="@")
+        parser.add_argument("files", nargs="*", help="The .gitignore files to merge, in order. Later files win when two patterns disagree. @list.txt reads the paths from list.txt, one per line.")
+        parser.add_argument("-r", "--recursive", type=str, metavar="ROOT", help="Find every .gitignore under ROOT and merge them into one root ignore file, rewriting each file's patterns relative to ROOT. Comes after any files given.")
+        parser.add_argument("-o", "--output", type=str, help="Where to write the merged file. The default is: .gitignore_merged", default=".gitignore_merged")
+        parser.add_argument("-q", "--quiet", help="Don't print the summary and the redundant/conflicting patterns.", action="store_true")
+        parser.add_argument("-s", "--stream", help="Write each file's patterns out as soon as it's read, for merging hundreds of files with flat memory. Skips the redundant/conflict report.", action="store_true")
+        parser.add_argument("-m", "--minimize", help="Drop redundant and overridden patterns and merge literals that only differ in one character (cache1/, cache2/ -> cache[12]/). Every step is checked to ignore exactly the same paths as before.", action="store_true")
+        parser.add_argument("--corpus", type=str, metavar="FILE", help="With --minimize, also check against the paths in FILE, one per line (e.g. the output of `git ls-files`).")
+        parser.add_argument("-c", "--compile", type=str, metavar="FILE", help="Also write the merged patterns as a precompiled matcher to FILE, for IgnoreSet.load().")
+        parser.add_argument("-j", "--jobs", type=int, help="How many files are read in parallel. The default is: 8", default=8)
+        args = parser.parse_args(argv)
+        if args.stream and (args.compile or args.minimize):
+            parser.error("-c/--compile and -m/--minimize need the whole merged list, they can't be used with -s/--stream")
+        if not args.files and not args.recursive:
+            parser.error("give the files to merge, or a folder to search with -r")
+        if args.recursive and not os.path.isdir(args.recursive):
+            parser.error(f"-r/--recursive: {args.recursive} is not a directory")
+        if args.jobs < 1:
+            parser.error(f"-j/--jobs must be at least 1, got {args.jobs}")
+        return args
+
     def input_files_abs_path(self, paths):
         return [os.path.join(self.current_directory, path) for path in paths]
 
-    def line_breaks(self, lines):
-        temp_list = []
-        temp_set = set()
-        for line in lines:
-            print(f"{len(line)}: {line}")
-            if len(line) == 0:
-                if len(temp_set) > 0:
-                    temp_list.append(temp_set)
-                    temp_set = set()
-            elif line not in self.already_seen:
-                self.all_lines
-                self.already_seen.add(line)
-            else:
-                self.already_seen.add(line)
-        return temp_list
-
     def reader(self, abs_filepath: str):
-        with open(abs_filepath, 'r') as f:
-            for line in f:
-                if line not in self.already_seen:
-                    self.all_lines.append(line)
-                    self.already_seen.add(line)
+        return read_patterns(abs_filepath, os.path.relpath(abs_filepath, self.current_directory))
 
     def read_all_files(self):
-        for filepath in self.input_files:
-            self.reader(filepath)
-            
+        sources = read_ahead(self.reader, self.input_files, self.jobs)
+        if self.root:
+            sources = itertools.chain(sources, discover(os.path.join(self.current_directory, self.root)))
+        for patterns in sources:
+            self.files_read += 1
+            yield patterns
+
     def writer(self, abs_filepath, data):
-        with open(abs_filepath, 'w') as f:
-            for line in data:
-                f.write(line)
+        # One "# file" header per input, in the order the patterns were kept
+        with open(abs_filepath, 'w', encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as f:
+            source = None
+            for p in data:
+                if p.source != source:
+                    if source is not None:
+                        f.write("\n")
+                    f.write(f"# {p.source}\n")
+                    source = p.source
+                f.write(p.text() + "\n")
+
+    def stream_driver(self):
+        with open(self.output_filename, 'w', encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as f:
+            read, written = stream_merge(self.read_all_files(), f)
+
+        if not self.quiet:
+            print(f"Merged {self.files_read} files: {read} patterns, {read - written} duplicates dropped, {written} written to {self.output_filename}")
 
     def driver(self):
-        self.read_all_files()
-        for l in self.all_lines:
-            print(l)
-        self.writer(self.output_filename, self.all_lines)
+        if self.stream:
+            self.stream_driver()
+            return
+
+        for patterns in self.read_all_files():
+            self.all_lines.extend(patterns)
+        self.patterns = dedupe(self.all_lines)
+        merged = len(self.patterns)
+        if self.minimize:
+            corpus = ()
+            if self.corpus:
+                with open(self.corpus, "r", encoding="utf-8") as f:
+                    corpus = [line.strip().strip("/") for line in f if line.strip()]
+            self.patterns, self.findings, collapsed, checked = minimize(self.patterns, corpus)
+        else:
+            self.findings = find_redundant(self.patterns)
+        self.writer(self.output_filename, self.patterns)
+        if self.compiled_filename:
+            IgnoreSet(self.patterns).save(self.compiled_filename)
+
+        if not self.quiet:
+            print(f"Merged {self.files_read} files: {len(self.all_lines)} patterns, {len(self.all_lines) - merged} duplicates dropped, {len(self.patterns)} written to {self.output_filename}")
+            if self.minimize:
+                print(f"Minimized: {len(self.findings)} patterns dropped, {collapsed} literals merged into globs. Checked on {checked} sample paths: same result as the full merge")
+            for finding in self.findings:
+                print(f"{'dropped ' if self.minimize else ''}{finding}")
+
 
-m = Merger()
+if __name__ == "__main__":
+    Merger()
@@ -0,0 +1,142 @@
+"""
+Times reading loan emails from saved .eml files: parsing the MIME message, getting the body out and parsing the
+loan details, against the old line-by-line parser as a reference.
+
+Usage: python benchmarks/bench_parser.py [--fixtures DIR] [--copies 500] [--repeat 5]
+
+Any .eml saved from Gmail ("Show original" -> "Download original") can be dropped into the fixtures folder. Emails
+whose subject isn't one of the two the dashboard reads are skipped. Every stage is run over --copies copies of the
+corpus, --repeat times, and the median is kept.
+"""
+import argparse
+import email
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import GmailSearcher, LoanFunded, ParseError, parse_loan_funded_email, parse_loan_repaid_email
+
+FUNDED_SUBJECT = "Loan funded = day made. Nice work!"
+REPAID_SUBJECT = "Congratulations -- your SoLo loan has been repaid!"
+
+
+def linewise_funded(body):
+    """
+    The if/elif parser the dashboard used before, kept to compare against. Like parse(), it builds and cleans the
+    LoanFunded.
+    """
+    labels = {
+        "Borrower": "borrower",
+        "Loan Reason": "loan_reason",
+        "Payback Date": "payback_date",
+        "Loan Principal": "loan_principal",
+        "*SoLo Donation*": "solo_donation",
+        "*Lender Tip*": "lender_tip",
+        "Payback Amount": "payback_amount",
+    }
+    lines = body.splitlines()
+    details = {}
+    for i in range(len(lines)):
+        if lines[i] in labels:
+            details[labels[lines[i]]] = lines[i + 1]
+    loan = LoanFunded(**details)
+    loan.clean()
+    return loan
+
+
+def linewise_repaid(body):
+    for line in body.splitlines():
+        if "has repaid their loan for" in line:
+            l = line.split(" has repaid their loan for ")
+            return f"{l[0]}/{float(l[1].split(' $')[1].split(' ')[0])}"
+
+
+def load_fixtures(folder):
+    fixtures = []
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith(".eml"):
+            continue
+        with open(os.path.join(folder, name), "rb") as f:
+            raw = f.read()
+        subject = GmailSearcher.decode_subject(email.message_from_bytes(raw)["Subject"])
+        if subject in (FUNDED_SUBJECT, REPAID_SUBJECT):
+            fixtures.append((name, subject == FUNDED_SUBJECT, raw))
+    return fixtures
+
+
+def parse(body, funded):
+    if funded:
+        loan = parse_loan_funded_email(body)
+        loan.clean()
+        return loan
+    return parse_loan_repaid_email(body)
+
+
+def median_time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fixtures", type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures"))
+    parser.add_argument("--copies", type=int, default=500, help="How many times the corpus is parsed per run")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        raise SystemExit(f"No SoLo emails in {args.fixtures}")
+
+    # What the parser makes of every fixture, so a template it can't read shows up next to the timings
+    for name, funded, raw in fixtures:
+        body = GmailSearcher.get_email_body(email.message_from_bytes(raw))
+        try:
+            print(f"{name:<28} {parse(body, funded)}")
+        except ParseError as e:
+            print(f"{name:<28} failed: {e}")
+    print()
+
+    corpus = fixtures * args.copies
+    messages = [(email.message_from_bytes(raw), funded) for _, funded, raw in corpus]
+    bodies = [(GmailSearcher.get_email_body(msg), funded) for msg, funded in messages]
+
+    def run_message():
+        for _, _, raw in corpus:
+            email.message_from_bytes(raw)
+
+    def run_body():
+        for msg, _ in messages:
+            GmailSearcher.get_email_body(msg)
+
+    def run_parse():
+        for body, funded in bodies:
+            try:
+                parse(body, funded)
+            except ParseError:
+                pass
+
+    def run_linewise():
+        for body, funded in bodies:
+            try:
+                linewise_funded(body) if funded else linewise_repaid(body)
+            except (IndexError, ValueError, AttributeError, TypeError):
+                pass
+
+    n = len(corpus)
+    print(f"{len(fixtures)} emails x {args.copies} copies")
+    for stage, fn in (("message_from_bytes", run_message), ("get_email_body", run_body), ("parse", run_parse),
+                      ("parse (line by line)", run_linewise)):
+        seconds = median_time(fn, args.repeat)
+        print(f"{stage:<22} {seconds / n * 1e6:9.2f} µs/email {n / seconds:12.0f} emails/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,21 +2,45 @@ import imaplib
 import csv
 import email
 import os
+import queue
+import re
+import sqlite3
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from itertools import compress, repeat
 from dataclasses import dataclass
+from operator import eq
 from dotenv import load_dotenv
+from html import unescape
 
 load_dotenv()  # take environment variables from .env
 
+# UIDs per FETCH command. Keeps a single command line well under what servers accept even when the UIDs aren't
+# consecutive and can't be written as ranges.
+FETCH_BATCH_SIZE = 500
+UID_PATTERN = re.compile(rb"\bUID (\d+)")
 
-@dataclass
+# Emails per task handed to the parsing processes, big enough that pickling them isn't most of the work
+PARSE_CHUNK_SIZE = 100
+
+# Where parsed mail is kept between runs, delete it to read the whole mailbox again
+CACHE_FILE = "solo_loans.sqlite3"
+
+
+STATUSES = ("Funded", "Paid")
+
+
+@dataclass(slots=True)
 class LoanFunded:
+    # The amounts are the "$1,234.50" strings from the email until clean() turns them into integer cents
     borrower: str
     loan_reason: str
     payback_date: str
-    loan_principal: str
-    solo_donation: str
-    lender_tip: str
-    payback_amount: str
+    loan_principal: str | int
+    solo_donation: str | int
+    lender_tip: str | int
+    payback_amount: str | int
     status: str = "Funded"  # Default status
 
     def get_key(self):
@@ -31,10 +55,10 @@ class LoanFunded:
         self.lender_tip = self.lender_tip.strip()
         self.payback_amount = self.payback_amount.strip()
 
-        self.loan_principal = float(self.loan_principal[1:])
-        self.solo_donation = float(self.solo_donation[1:])
-        self.lender_tip = float(self.lender_tip[1:])
-        self.payback_amount = float(self.payback_amount[1:])
+        self.loan_principal = parse_cents(self.loan_principal)
+        self.solo_donation = parse_cents(self.solo_donation)
+        self.lender_tip = parse_cents(self.lender_tip)
+        self.payback_amount = parse_cents(self.payback_amount)
 
     def serialize(self):
         return {
@@ -48,38 +72,117 @@ class LoanFunded:
         }
 
 
-def parse_loan_funded_email(msg) -> LoanFunded:
-    lines = msg.splitlines()
-    details = {}
-
-    for i in range(len(lines)):
-        if lines[i] == "Borrower":
-            details["borrower"] = lines[i + 1]
-        elif lines[i] == "Loan Reason":
-            details["loan_reason"] = lines[i + 1]
-        elif lines[i] == "Payback Date":
-            details["payback_date"] = lines[i + 1]
-        elif lines[i] == "Loan Principal":
-            details["loan_principal"] = lines[i + 1]
-        elif lines[i] == "*SoLo Donation*":
-            details["solo_donation"] = lines[i + 1]
-        elif lines[i] == "*Lender Tip*":
-            details["lender_tip"] = lines[i + 1]
-        elif lines[i] == "Payback Amount":
-            details["payback_amount"] = lines[i + 1]
+class ParseError(ValueError):
+    """
+    An email didn't have the expected content, e.g. because SoLo changed the template.
+    """
+
+
+# Label in the email -> LoanFunded field. Labels are matched on a line of their own, with or without *bold*
+# markers around them, and the value is the next line that isn't blank. The patterns start with a newline rather than
+# ^ so the regex engine can skip ahead to the next line instead of trying the labels at every character.
+FUNDED_LABELS = {
+    "Borrower": "borrower",
+    "Loan Reason": "loan_reason",
+    "Payback Date": "payback_date",
+    "Loan Principal": "loan_principal",
+    "SoLo Donation": "solo_donation",
+    "Lender Tip": "lender_tip",
+    "Payback Amount": "payback_amount",
+}
+FUNDED_PATTERN = re.compile(r"\n[ \t*\xa0]*(" + "|".join(map(re.escape, FUNDED_LABELS)) + r")[ \t*\xa0]*\r?\n\s*(.*\S)")
+REPAID_PATTERN = re.compile(r"\n\s*(.*?\S) has repaid their loan for (.*?) \$([\d,]+(?:\.\d+)?)")
+AMOUNT_PATTERN = re.compile(r"\$?(\d[\d,]*)(?:\.(\d\d?))?")
+
+# A rough HTML to text conversion that keeps every table cell and paragraph on its own line, which is all the
+# parsers above need
+HTML_DROP = re.compile(r"<(script|style|head)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+HTML_BREAK = re.compile(r"<(?:br|/?(?:p|div|tr|td|th|li|h[1-6]|table|ul|ol))\b[^>]*>", re.IGNORECASE)
+HTML_TAG = re.compile(r"<[^>]*>")
+
+
+def html_to_text(text):
+    text = HTML_DROP.sub("", text)
+    text = HTML_BREAK.sub("\n", text)
+    return unescape(HTML_TAG.sub("", text))
+
+
+def parse_cents(text):
+    """
+    "$1,234.5" -> 123450
+    """
+    match = AMOUNT_PATTERN.fullmatch(text.strip())
+    if match is None:
+        raise ParseError(f"not an amount: {text!r}")
+    dollars, cents = match.groups()
+    return int(dollars.replace(",", "")) * 100 + int((cents or "0").ljust(2, "0"))
+
+
+def format_cents(cents):
+    """
+    123450 -> "1234.50", the way amounts are written to the CSV.
+    """
+    return f"{cents // 100}.{cents % 100:02d}"
+
+
+def payback_month(payback_date):
+    """
+    "03/14/2025" -> 202503, or 0 if the date isn't MM/DD/YYYY.
+    """
+    parts = payback_date.split("/")
+    if len(parts) == 3 and parts[0].isdigit() and parts[2].isdigit() and 1 <= int(parts[0]) <= 12:
+        return int(parts[2]) * 100 + int(parts[0])
+    return 0
+
 
+def parse_loan_funded_email(msg) -> LoanFunded:
+    details = {FUNDED_LABELS[label]: value for label, value in FUNDED_PATTERN.findall("\n" + msg)}
+    if len(details) < len(FUNDED_LABELS):
+        missing = [label for label, field in FUNDED_LABELS.items() if field not in details]
+        raise ParseError(f"no {', '.join(missing)} in the email")
     return LoanFunded(**details)
 
 
 def parse_loan_repaid_email(msg):
-    lines = msg.splitlines()
-    for i in range(len(lines)):
-        if "has repaid their loan for" in lines[i]:
-            l = lines[i].split(" has repaid their loan for ")
-            name = l[0]
-            reason = l[1].split(" $")[0]
-            amount = l[1].split(" $")[1].split(" ")[0]
-            return f"{name}/{float(amount)}"
+    match = REPAID_PATTERN.search("\n" + msg)
+    if match is None:
+        raise ParseError("no \"has repaid their loan for\" line in the email")
+    name, reason, amount = match.groups()
+    return f"{name}/{parse_cents(amount)}"
+
+
+def parse_raw_emails(raw_emails):
+    """
+    Parse fetched emails into loans and repayment keys. This runs in the parsing processes, so everything it takes
+    and returns has to pickle.
+
+    Parameters:
+        raw_emails (list): (uid, raw email bytes, True for a funded email / False for a repaid one) tuples.
+
+    Returns:
+        tuple: The (uid, cleaned LoanFunded) pairs, the (uid, repayment key) pairs and the (uid, subject, error)
+        tuples for the emails that couldn't be parsed.
+    """
+    funded = []
+    repaid = []
+    failed = []
+    for uid, raw, is_funded in raw_emails:
+        email_msg = None
+        # Anything one email does wrong (an unknown charset, a broken MIME structure, ...) only fails that email
+        try:
+            email_msg = email.message_from_bytes(raw)
+            body = GmailSearcher.get_email_body(email_msg)
+            if is_funded:
+                loan = parse_loan_funded_email(body)
+                loan.clean()
+                funded.append((uid, loan))
+            else:
+                repaid.append((uid, parse_loan_repaid_email(body)))
+        except ParseError as e:
+            failed.append((uid, email_msg["Subject"], str(e)))
+        except Exception as e:
+            failed.append((uid, email_msg and email_msg["Subject"], f"{type(e).__name__}: {e}"))
+    return funded, repaid, failed
 
 
 def write_funded_loans_to_csv(data: [LoanFunded], filename):
@@ -103,35 +206,344 @@ def write_funded_loans_to_csv(data: [LoanFunded], filename):
                     loan.borrower,
                     loan.loan_reason,
                     loan.payback_date,
-                    loan.loan_principal,
-                    loan.solo_donation,
-                    loan.lender_tip,
-                    loan.payback_amount,
+                    format_cents(loan.loan_principal),
+                    format_cents(loan.solo_donation),
+                    format_cents(loan.lender_tip),
+                    format_cents(loan.payback_amount),
                     loan.status,
                 ]
             )
 
 
+class LoanTable:
+    """
+    Cleaned loans stored column by column: the amounts as integer cents in arrays, the status as an index into
+    STATUSES and the payback date also as a YYYYMM number to group by.
+
+    That's a few bytes per loan instead of a LoanFunded object per loan, and every aggregate is a sum() over whole
+    columns filtered with itertools.compress(), which runs in C without creating an object per loan. All amounts
+    returned are in cents.
+    """
+
+    __slots__ = (
+        "borrower",
+        "loan_reason",
+        "payback_date",
+        "payback_month",
+        "loan_principal",
+        "solo_donation",
+        "lender_tip",
+        "payback_amount",
+        "status",
+    )
+    AMOUNTS = ("loan_principal", "solo_donation", "lender_tip", "payback_amount")
+
+    def __init__(self):
+        self.borrower = []
+        self.loan_reason = []
+        self.payback_date = []
+        self.payback_month = array("l")
+        self.loan_principal = array("q")
+        self.solo_donation = array("q")
+        self.lender_tip = array("q")
+        self.payback_amount = array("q")
+        self.status = array("b")
+
+    @classmethod
+    def from_loans(cls, loans):
+        table = cls()
+        for loan in loans:
+            table.append(loan)
+        return table
+
+    def append(self, loan):
+        """
+        Add a cleaned LoanFunded.
+        """
+        self.borrower.append(loan.borrower)
+        self.loan_reason.append(loan.loan_reason)
+        self.payback_date.append(loan.payback_date)
+        self.payback_month.append(payback_month(loan.payback_date))
+        self.loan_principal.append(loan.loan_principal)
+        self.solo_donation.append(loan.solo_donation)
+        self.lender_tip.append(loan.lender_tip)
+        self.payback_amount.append(loan.payback_amount)
+        self.status.append(STATUSES.index(loan.status))
+
+    def __len__(self):
+        return len(self.status)
+
+    def where(self, status):
+        """
+        A mask over the rows with the given status, for itertools.compress().
+        """
+        return map(eq, self.status, repeat(STATUSES.index(status)))
+
+    def total(self, column, status=None):
+        """
+        The sum of an amount column, over all loans or only the ones with the given status.
+        """
+        values = getattr(self, column)
+        return sum(values) if status is None else sum(compress(values, self.where(status)))
+
+    def totals_by_status(self):
+        """
+        Returns:
+            dict: status -> {"loans": count, "loan_principal": cents, "solo_donation": ..., "lender_tip": ...,
+            "payback_amount": ...}, for every status at least one loan has.
+        """
+        totals = {}
+        for status in STATUSES:
+            count = self.status.count(STATUSES.index(status))
+            if count:
+                totals[status] = {"loans": count, **{column: self.total(column, status) for column in self.AMOUNTS}}
+        return totals
+
+    def payback(self):
+        """
+        Returns:
+            dict: "expected" is what all loans are to pay back, "received" what the repaid ones did and
+            "outstanding" what's still to come. "profit" is received minus the principal of the repaid loans.
+        """
+        received = self.total("payback_amount", "Paid")
+        return {
+            "expected": self.total("payback_amount"),
+            "received": received,
+            "outstanding": self.total("payback_amount", "Funded"),
+            "profit": received - self.total("loan_principal", "Paid"),
+        }
+
+    def outstanding_by_month(self):
+        """
+        Returns:
+            dict: "YYYY-MM" of the payback date -> principal of the loans that aren't repaid yet, in month order.
+            Loans with a payback date that couldn't be read are under "unknown".
+        """
+        by_month = {}
+        for month, principal in compress(zip(self.payback_month, self.loan_principal), self.where("Funded")):
+            by_month[month] = by_month.get(month, 0) + principal
+        return {f"{month // 100}-{month % 100:02d}" if month else "unknown": by_month[month] for month in sorted(by_month)}
+
+
+class LoanCache:
+    """
+    Parsed loans and repayments kept in SQLite between runs, so a run only downloads the mail that arrived since
+    the last one.
+
+    Every row is stored with its IMAP UID. UIDs are only stable while the mailbox's UIDVALIDITY stays the same, so
+    when it changes everything is dropped and the next run reads the whole history again. Emails that couldn't be
+    parsed are kept in the failed table, which every run fetches again, since the last UID moves past them.
+
+    VERSION is stored as the database's user_version, a cache written by a version that stored things differently is
+    dropped and filled again.
+    """
+
+    VERSION = 1
+
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename)
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != self.VERSION:
+            self.db.executescript(
+                f"""
+                DROP TABLE IF EXISTS mailbox;
+                DROP TABLE IF EXISTS last_uid;
+                DROP TABLE IF EXISTS funded;
+                DROP TABLE IF EXISTS repaid;
+                DROP TABLE IF EXISTS failed;
+                PRAGMA user_version = {self.VERSION};
+                """
+            )
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS mailbox (name TEXT PRIMARY KEY, uidvalidity INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS last_uid (subject TEXT PRIMARY KEY, uid INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS funded (
+                uid INTEGER PRIMARY KEY,
+                borrower TEXT,
+                loan_reason TEXT,
+                payback_date TEXT,
+                loan_principal INTEGER,
+                solo_donation INTEGER,
+                lender_tip INTEGER,
+                payback_amount INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS repaid (uid INTEGER PRIMARY KEY, key TEXT);
+            CREATE TABLE IF NOT EXISTS failed (uid INTEGER PRIMARY KEY, subject TEXT NOT NULL, error TEXT);
+            """
+        )
+
+    def check_uidvalidity(self, mailbox, uidvalidity):
+        """
+        Drop everything if the mailbox's UIDVALIDITY isn't the one the cache was filled with.
+
+        Returns:
+            bool: True if the cache was kept.
+        """
+        row = self.db.execute("SELECT uidvalidity FROM mailbox WHERE name = ?", (mailbox,)).fetchone()
+        if row is not None and row[0] == uidvalidity:
+            return True
+        with self.db:
+            for table in ("mailbox", "last_uid", "funded", "repaid", "failed"):
+                self.db.execute(f"DELETE FROM {table}")
+            self.db.execute("INSERT INTO mailbox VALUES (?, ?)", (mailbox, uidvalidity))
+        return row is None
+
+    def last_uid(self, subject):
+        """
+        The highest UID already read for subject, or 0.
+        """
+        row = self.db.execute("SELECT uid FROM last_uid WHERE subject = ?", (subject,)).fetchone()
+        return row[0] if row else 0
+
+    def failed_uids(self, subject):
+        """
+        The UIDs of the emails for subject that couldn't be parsed so far, to try them again.
+        """
+        return [str(uid).encode() for uid, in self.db.execute("SELECT uid FROM failed WHERE subject = ? ORDER BY uid", (subject,))]
+
+    def unread(self, uids):
+        """
+        The uids that aren't stored as a loan or repayment yet. After an interrupted run, that's what it didn't get to.
+        """
+        stored = set()
+        for i in range(0, len(uids), 500):
+            chunk = [int(uid) for uid in uids[i:i + 500]]
+            marks = ", ".join("?" * len(chunk))
+            for table in ("funded", "repaid"):
+                stored.update(uid for uid, in self.db.execute(f"SELECT uid FROM {table} WHERE uid IN ({marks})", chunk))
+        return [uid for uid in uids if int(uid) not in stored]
+
+    def add(self, subject, funded=(), repaid=(), failed=()):
+        """
+        Store newly read mail for subject in one transaction. Called for every chunk as it's parsed, so an
+        interrupted run keeps what it already read.
+
+        Parameters:
+            funded (list): (uid, LoanFunded) pairs, already cleaned.
+            repaid (list): (uid, key) pairs.
+            failed (list): (uid, error message) pairs for the emails that couldn't be parsed.
+        """
+        parsed = [(int(uid),) for uid, _ in funded] + [(int(uid),) for uid, _ in repaid]
+        with self.db:
+            self.db.executemany("DELETE FROM failed WHERE uid = ?", parsed)
+            self.db.executemany(
+                "INSERT OR REPLACE INTO failed VALUES (?, ?, ?)", [(int(uid), subject, error) for uid, error in failed]
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO funded VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        int(uid),
+                        loan.borrower,
+                        loan.loan_reason,
+                        loan.payback_date,
+                        loan.loan_principal,
+                        loan.solo_donation,
+                        loan.lender_tip,
+                        loan.payback_amount,
+                    )
+                    for uid, loan in funded
+                ],
+            )
+            self.db.executemany("INSERT OR REPLACE INTO repaid VALUES (?, ?)", [(int(uid), key) for uid, key in repaid])
+
+    def mark_read(self, subject, uids):
+        """
+        Move subject's last UID up to the highest of uids. Only call this once every one of them is stored with
+        add(), chunks finish out of order and a later run only searches above the last UID.
+        """
+        if uids:
+            with self.db:
+                self.db.execute(
+                    "INSERT INTO last_uid VALUES (?, ?) ON CONFLICT(subject) DO UPDATE SET uid = MAX(uid, excluded.uid)",
+                    (subject, max(int(uid) for uid in uids)),
+                )
+
+    def loans(self):
+        """
+        Every cached loan, oldest mail first.
+        """
+        rows = self.db.execute(
+            "SELECT borrower, loan_reason, payback_date, loan_principal, solo_donation, lender_tip, payback_amount "
+            "FROM funded ORDER BY uid"
+        )
+        return [LoanFunded(*row) for row in rows]
+
+    def repaid_keys(self):
+        """
+        The get_key() of every loan a repayment mail was read for.
+        """
+        return {key for key, in self.db.execute("SELECT key FROM repaid") if key is not None}
+
+    def loans_with_status(self):
+        """
+        Every cached loan once per get_key(), marked Paid if its repayment mail was read.
+        """
+        loans = {l.get_key(): l for l in self.loans()}
+        for key in self.repaid_keys():
+            if key in loans:
+                loans[key].status = "Paid"
+        return list(loans.values())
+
+    def close(self):
+        self.db.close()
+
+
 class GmailSearcher:
-    def __init__(self, username, password, mailbox="inbox"):
+    def __init__(self, username, password, mailbox="inbox", connections=1):
         """
         Initialize the GmailSearcher with your Gmail credentials and desired mailbox.
+
+        With connections > 1 that many connections are opened and batched fetches run on all of them at once.
+        Gmail allows up to 15 per account.
         """
         self.username = username
         self.password = password
         self.mailbox = mailbox
+        self.connections = max(1, connections)
         self.mail = None
+        self.uidvalidity = None
+        # Idle connections. A connection is only ever used by one thread at a time, imaplib isn't thread safe.
+        self.pool = None
+        self.executor = None
         self.connect()
 
-    def connect(self):
+    def open_connection(self):
         """
-        Connect to the Gmail IMAP server and log in.
+        Open one connection to the Gmail IMAP server, log in and select the mailbox.
         """
-        self.mail = imaplib.IMAP4_SSL("imap.gmail.com")
-        self.mail.login(self.username, self.password)
-        self.mail.select(self.mailbox)
+        mail = imaplib.IMAP4_SSL("imap.gmail.com")
+        mail.login(self.username, self.password)
+        mail.select(self.mailbox)
+        return mail
 
-    def decode_subject(self, subject):
+    def connect(self):
+        """
+        Connect to the Gmail IMAP server and log in, opening all the connections in parallel.
+        """
+        self.mail = self.open_connection()
+        # UIDs only identify a message as long as the mailbox keeps its UIDVALIDITY
+        self.uidvalidity = int(self.mail.response("UIDVALIDITY")[1][0])
+
+        self.executor = ThreadPoolExecutor(self.connections)
+        self.pool = queue.Queue()
+        self.pool.put(self.mail)
+        for mail in self.executor.map(lambda _: self.open_connection(), range(self.connections - 1)):
+            self.pool.put(mail)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow an idle connection, waiting for one if they're all busy.
+        """
+        mail = self.pool.get()
+        try:
+            yield mail
+        finally:
+            self.pool.put(mail)
+
+    @staticmethod
+    def decode_subject(subject):
         """
         Decode an email subject header.
         """
@@ -145,52 +557,140 @@ class GmailSearcher:
             decoded_subject += part
         return decoded_subject
 
-    def search_by_subject(self, exact_subject):
+    @staticmethod
+    def uid_set(uids):
+        """
+        Write UIDs as an IMAP sequence set, with runs of consecutive UIDs as ranges: 1,2,3,7 -> 1:3,7.
+        """
+        numbers = sorted(int(uid) for uid in uids)
+        ranges = []
+        start = prev = numbers[0]
+        for n in numbers[1:]:
+            if n != prev + 1:
+                ranges.append(f"{start}:{prev}" if prev != start else str(start))
+                start = n
+            prev = n
+        ranges.append(f"{start}:{prev}" if prev != start else str(start))
+        return ",".join(ranges)
+
+    def fetch_batch(self, uids, query):
+        """
+        Fetch the same items for many messages with one UID FETCH command on whichever connection is idle.
+
+        Returns:
+            dict: UID (bytes) -> the fetched literal (bytes). Messages the server didn't return are left out.
+        """
+        with self.connection() as mail:
+            result, data = mail.uid("FETCH", self.uid_set(uids), query)
+        if result != "OK":
+            raise imaplib.IMAP4.error(f"FETCH failed: {data}")
+
+        fetched = {}
+        # Every message is a (b"<seq> (UID <uid> BODY[...] {<size>}", literal) tuple followed by b")"
+        for item in data:
+            if isinstance(item, tuple):
+                match = UID_PATTERN.search(item[0])
+                if match:
+                    fetched[match.group(1)] = item[1]
+        return fetched
+
+    def iter_fetch_batched(self, uids, query):
+        """
+        Fetch the same items for many messages in batches spread over all connections, yielding each batch's
+        fetch_batch() result as soon as it arrives, so not in the order of uids.
+
+        Batches hold at most FETCH_BATCH_SIZE UIDs, fewer if that's needed to give every connection something to do.
+        """
+        if not uids:
+            return
+        size = min(FETCH_BATCH_SIZE, -(-len(uids) // self.connections))
+        futures = [self.executor.submit(self.fetch_batch, uids[i:i + size], query) for i in range(0, len(uids), size)]
+        for future in as_completed(futures):
+            yield future.result()
+
+    def fetch_batched(self, uids, query):
+        """
+        Fetch the same items for many messages, in batches over all connections instead of one round trip each.
+
+        Parameters:
+            uids (list): The UIDs to fetch.
+            query (str): The items to fetch, e.g. "(BODY.PEEK[])".
+
+        Returns:
+            dict: UID (bytes) -> the fetched literal (bytes). Messages the server didn't return are left out.
+        """
+        fetched = {}
+        for batch in self.iter_fetch_batched(uids, query):
+            fetched.update(batch)
+        return fetched
+
+    def search_by_subject(self, exact_subject, after_uid=0):
         """
         Search for emails with an exact subject.
 
+        Only the Subject header of the candidates is downloaded, in batches, and PEEK leaves them unread.
+
         Parameters:
             exact_subject (str): The exact subject string to search for.
+            after_uid (int): Only look at emails with a higher UID, i.e. that arrived after it.
 
         Returns:
-            list: A list of email IDs that match the exact subject.
+            list: A list of email UIDs that match the exact subject, oldest first.
         """
         # Initial search using the SUBJECT keyword. This may return emails where the subject
         # contains the search string.
-        result, data = self.mail.search(None, "SUBJECT", f'"{exact_subject}"')
-        email_ids = data[0].split()
-        exact_matching_ids = []
+        criteria = ["SUBJECT", f'"{exact_subject}"']
+        if after_uid:
+            criteria = ["UID", f"{after_uid + 1}:*"] + criteria
+        with self.connection() as mail:
+            result, data = mail.uid("SEARCH", None, *criteria)
+        # "n:*" always includes the newest email, even when its UID is below n
+        email_uids = [uid for uid in data[0].split() if int(uid) > after_uid]
+        if not email_uids:
+            return []
+
+        # Filter the found emails for an exact subject match.
+        headers = self.fetch_batched(email_uids, "(BODY.PEEK[HEADER.FIELDS (SUBJECT)])")
+        exact_matching_uids = []
+        for uid in email_uids:
+            header = headers.get(uid)
+            if header is None:
+                continue
+            subject = self.decode_subject(email.message_from_bytes(header)["Subject"])
+            if subject == exact_subject:
+                exact_matching_uids.append(uid)
 
-        # Iterate over the found emails and filter for an exact subject match.
-        for email_id in email_ids:
-            result, msg_data = self.mail.fetch(email_id, "(RFC822)")
-            raw_email = msg_data[0][1]
-            msg = email.message_from_bytes(raw_email)
-            subject = self.decode_subject(msg["Subject"])
+        return exact_matching_uids
 
-            if subject == exact_subject:
-                exact_matching_ids.append(email_id)
+    def get_email_contents(self, email_uids):
+        """
+        Retrieve the email content for many UIDs, in batches.
+
+        Parameters:
+            email_uids (list): The UIDs to fetch, as returned by search_by_subject.
 
-        return exact_matching_ids
+        Returns:
+            dict: UID -> the parsed email.message.Message, in the order of email_uids.
+        """
+        bodies = self.fetch_batched(email_uids, "(BODY.PEEK[])")
+        return {uid: email.message_from_bytes(bodies[uid]) for uid in email_uids if uid in bodies}
 
-    def get_email_content_by_id(self, email_id):
+    def get_email_content_by_id(self, email_uid):
         """
-        Retrieve the email content for a given email ID.
+        Retrieve the email content for a given email UID.
 
         Parameters:
-            email_id (bytes): The email ID to fetch.
+            email_uid (bytes): The email UID to fetch.
 
         Returns:
             email.message.Message: The parsed email message object.
         """
-        result, msg_data = self.mail.fetch(email_id, "(RFC822)")
-        raw_email = msg_data[0][1]
-        msg = email.message_from_bytes(raw_email)
-        return msg
+        return self.get_email_contents([email_uid])[email_uid]
 
-    def get_email_body(self, email_message):
+    @staticmethod
+    def get_email_body(email_message):
         """
-        Extracts and returns the plain text body from an email message.
+        Extracts and returns the plain text body from an email message. HTML-only emails are converted to text.
 
         Args:
             email_message (email.message.EmailMessage): The email message object.
@@ -198,42 +698,40 @@ class GmailSearcher:
         Returns:
             str: The decoded plain text body of the email, or an empty string if not found.
         """
-        body = ""
-
-        # Check if the message is multipart
-        if email_message.is_multipart():
-            # Iterate over email parts
-            for part in email_message.walk():
-                content_type = part.get_content_type()
-                content_disposition = str(part.get("Content-Disposition"))
-
-                # Look for the plain text part and skip attachments
-                if (
-                    content_type == "text/plain"
-                    and "attachment" not in content_disposition
-                ):
-                    payload = part.get_payload(decode=True)
-                    if payload:
-                        body = payload.decode(
-                            part.get_content_charset("utf-8"), errors="replace"
-                        )
-                        break
-        else:
-            # For non-multipart messages, get the payload directly
-            payload = email_message.get_payload(decode=True)
+        html_part = None
+
+        # Iterate over email parts, for non-multipart messages that's just the message itself
+        for part in email_message.walk():
+            content_type = part.get_content_type()
+            if content_type not in ("text/plain", "text/html"):
+                continue
+
+            # Skip attachments
+            if "attachment" in str(part.get("Content-Disposition")):
+                continue
+
+            if content_type == "text/plain":
+                payload = part.get_payload(decode=True)
+                if payload:
+                    return payload.decode(part.get_content_charset("utf-8"), errors="replace")
+            elif html_part is None:
+                html_part = part
+
+        if html_part is not None:
+            payload = html_part.get_payload(decode=True)
             if payload:
-                body = payload.decode(
-                    email_message.get_content_charset("utf-8"), errors="replace"
-                )
+                return html_to_text(payload.decode(html_part.get_content_charset("utf-8"), errors="replace"))
 
-        return body
+        return ""
 
     def logout(self):
         """
-        Logout from the Gmail IMAP server.
+        Logout from the Gmail IMAP server, closing every connection.
         """
         if self.mail:
-            self.mail.logout()
+            self.executor.shutdown()
+            while not self.pool.empty():
+                self.pool.get().logout()
             self.mail = None
 
 
@@ -246,34 +744,75 @@ if __name__ == "__main__":
     password = os.getenv("password")  # Use an app-specific password if needed
     loan_funded_subject = "Loan funded = day made. Nice work!"
     load_repaid_subject = "Congratulations -- your SoLo loan has been repaid!"
-    searcher = GmailSearcher(username, password)
-
-    # Example: Search for emails with a specific subject.
-    # subject_to_search = "Your Exact Subject Here"
-    matching_email_ids = searcher.search_by_subject(loan_funded_subject)
-    print("Emails with an exact matching subject:", matching_email_ids)
-
-    # If there is at least one matching email, get its contents.
-    loans = []
-    if matching_email_ids:
-        for i in matching_email_ids:
-            email_msg = searcher.get_email_content_by_id(i)
-            body = searcher.get_email_body(email_msg)
-            loan = parse_loan_funded_email(body)
-            loan.clean()
-            loans.append(loan)
-
-    loans_dict = {l.get_key(): l for l in loans}
-    loans_paid = []
-    matching_email_ids = searcher.search_by_subject(load_repaid_subject)
-    print("Emails with an exact matching subject:", matching_email_ids)
-    if matching_email_ids:
-        for i in matching_email_ids:
-            email_msg = searcher.get_email_content_by_id(i)
-            body = searcher.get_email_body(email_msg)
-            key = parse_loan_repaid_email(body)
-            if key in loans_dict:
-                loans_dict[key].status = "Paid"
-
-    write_funded_loans_to_csv(loans_dict.values(), "funded_solo_loans.csv")
+    # Parallel IMAP connections, Gmail allows up to 15
+    connections = int(os.getenv("connections", 4))
+    searcher = GmailSearcher(username, password, connections=connections)
+    cache = LoanCache(CACHE_FILE)
+    if not cache.check_uidvalidity(searcher.mailbox, searcher.uidvalidity):
+        print("The mailbox's UIDVALIDITY changed, reading all emails again")
+
+    # Only the emails that arrived since the last run are searched and downloaded, the rest comes from the cache.
+    # Emails earlier runs couldn't parse are downloaded again too.
+    funded_ids = searcher.search_by_subject(loan_funded_subject, cache.last_uid(loan_funded_subject))
+    print("New emails with an exact matching subject:", funded_ids)
+    repaid_ids = searcher.search_by_subject(load_repaid_subject, cache.last_uid(load_repaid_subject))
+    print("New emails with an exact matching subject:", repaid_ids)
+    retry_funded = cache.failed_uids(loan_funded_subject)
+    retry_repaid = cache.failed_uids(load_repaid_subject)
+    if retry_funded or retry_repaid:
+        print(f"Trying {len(retry_funded) + len(retry_repaid)} emails that couldn't be read before again")
+    funded_ids += retry_funded
+    repaid_ids += retry_repaid
+
+    # A run that was interrupted already stored part of what it found
+    found_funded, found_repaid = funded_ids, repaid_ids
+    funded_ids = cache.unread(funded_ids)
+    repaid_ids = cache.unread(repaid_ids)
+
+    # Both kinds are downloaded together so their batches share all the connections. Every batch is handed to the
+    # parsing processes as soon as it arrives, so parsing runs while the next batches are still downloading, and
+    # every parsed chunk is stored right away.
+    funded_set = set(funded_ids)
+    failed = []
+
+    def store(future):
+        chunk_funded, chunk_repaid, chunk_failed = future.result()
+        cache.add(loan_funded_subject, funded=chunk_funded, failed=[(uid, e) for uid, _, e in chunk_failed if uid in funded_set])
+        cache.add(load_repaid_subject, repaid=chunk_repaid, failed=[(uid, e) for uid, _, e in chunk_failed if uid not in funded_set])
+        failed.extend(chunk_failed)
+
+    with ProcessPoolExecutor() as parsers:
+        pending = set()
+        try:
+            for batch in searcher.iter_fetch_batched(sorted(funded_set.union(repaid_ids), key=int), "(BODY.PEEK[])"):
+                raw_emails = [(uid, raw, uid in funded_set) for uid, raw in batch.items()]
+                for i in range(0, len(raw_emails), PARSE_CHUNK_SIZE):
+                    pending.add(parsers.submit(parse_raw_emails, raw_emails[i:i + PARSE_CHUNK_SIZE]))
+                for future in [future for future in pending if future.done()]:
+                    pending.remove(future)
+                    store(future)
+        finally:
+            # Even if the download broke off, whatever was fetched is parsed and stored
+            for future in as_completed(pending):
+                store(future)
+    cache.mark_read(loan_funded_subject, found_funded)
+    cache.mark_read(load_repaid_subject, found_repaid)
+
+    if failed:
+        print(f"Couldn't read {len(failed)} emails, they're left out and tried again next run:")
+        for uid, subject, e in failed:
+            print(f"  UID {uid.decode()} ({subject}): {e}")
+
+    loans = cache.loans_with_status()
+
+    write_funded_loans_to_csv(loans, "funded_solo_loans.csv")
+
+    table = LoanTable.from_loans(loans)
+    for status, totals in table.totals_by_status().items():
+        print(f"{status}: {totals['loans']} loans, ${format_cents(totals['loan_principal'])} lent, ${format_cents(totals['payback_amount'])} payback")
+    payback = table.payback()
+    print(f"Payback: ${format_cents(payback['received'])} of ${format_cents(payback['expected'])} received, ${format_cents(payback['profit'])} profit")
+    for month, principal in table.outstanding_by_month().items():
+        print(f"  {month}: ${format_cents(principal)} outstanding")
+    cache.close()
     searcher.logout()